@@ -1,4 +1,5 @@
 """Documents endpoint."""
+import asyncio
 import logging
 import shutil
 from datetime import datetime
@@ -200,25 +201,12 @@ async def delete_document(doc_id: str):
     
     # Remove from processed files tracker to prevent re-adding on restart
     try:
-        from app.services.library_processor import LibraryProcessor
-        processor = LibraryProcessor()
-        processed_files = processor.get_processed_files()
-        
-        # Find and remove entry by doc_id
-        file_path_to_remove = None
-        for file_path_str, file_info in processed_files.items():
-            if file_info.get('doc_id') == doc_id:
-                file_path_to_remove = file_path_str
-                break
-        
-        if file_path_to_remove:
-            processed_files.pop(file_path_to_remove, None)
-            # Save updated tracker
-            tracker_file = Path(settings.processed_files_tracker)
-            tracker_file.parent.mkdir(parents=True, exist_ok=True)
-            with open(tracker_file, 'w') as f:
-                import json
-                json.dump(processed_files, f, indent=2)
+        from app.services.library_processor import get_library_processor
+        processor = get_library_processor()
+        if processor.remove_processed(doc_id):
+            # Snapshots the vector store and rewrites the tracker file; keep
+            # that disk I/O off the event loop
+            await asyncio.to_thread(processor.flush_tracker)
             logger.info(f"Removed doc_id {doc_id} from processed files tracker")
     except Exception as exc:
         logger.warning("Failed to remove document from processed files tracker: %s", exc, exc_info=True)
@@ -110,7 +110,7 @@ async def ingest_document(
         
         # Parse document
         parser = DocumentParser()
-        text, page_count, image_paths = parser.parse(str(original_path), doc_id)
+        text, page_count, image_paths, pages = parser.parse(str(original_path), doc_id)
         text = parser.clean_text(text)
         
         if not text or len(text.strip()) < 50:
@@ -125,16 +125,10 @@ async def ingest_document(
             'filename': final_document_name
         }
         
-        # For multi-page documents, chunk per page
+        # Chunk per page
         chunks = []
-        if page_count > 1:
-            # Simple page splitting (in production, use page markers from parser)
-            pages = text.split("--- Page")
-            for page_num, page_text in enumerate(pages[1:], 1):
-                page_chunks = chunker.chunk_text(page_text, doc_id, page_num, metadata)
-                chunks.extend(page_chunks)
-        else:
-            chunks = chunker.chunk_text(text, doc_id, 1, metadata)
+        for page_num, page_text in enumerate(pages, 1):
+            chunks.extend(chunker.chunk_text(parser.clean_text(page_text), doc_id, page_num, metadata))
         
         # Add filename to chunks
         for chunk in chunks:
@@ -154,6 +148,7 @@ async def ingest_document(
         # Store in vector DB
         vector_store = VectorStore()
         vector_store.add_chunks(chunks, embeddings)
+        vector_store.flush()
         
         # Optionally generate summary using RAG
         summary: Optional[DocumentSummary] = None
@@ -473,7 +468,7 @@ async def ingest_from_url(
         
         # Parse document
         parser = DocumentParser()
-        text, page_count, image_paths = parser.parse(str(pdf_path), doc_id)
+        text, page_count, image_paths, pages = parser.parse(str(pdf_path), doc_id)
         text = parser.clean_text(text)
         
         if not text or len(text.strip()) < 50:
@@ -488,15 +483,10 @@ async def ingest_from_url(
             'filename': final_document_name
         }
         
-        # For multi-page documents, chunk per page
+        # Chunk per page
         chunks = []
-        if page_count > 1:
-            pages = text.split("--- Page")
-            for page_num, page_text in enumerate(pages[1:], 1):
-                page_chunks = chunker.chunk_text(page_text, doc_id, page_num, metadata)
-                chunks.extend(page_chunks)
-        else:
-            chunks = chunker.chunk_text(text, doc_id, 1, metadata)
+        for page_num, page_text in enumerate(pages, 1):
+            chunks.extend(chunker.chunk_text(parser.clean_text(page_text), doc_id, page_num, metadata))
         
         # Add filename to chunks
         for chunk in chunks:
@@ -516,6 +506,7 @@ async def ingest_from_url(
         # Store in vector DB
         vector_store = VectorStore()
         vector_store.add_chunks(chunks, embeddings)
+        vector_store.flush()
         
         # Optionally generate summary using RAG
         summary: Optional[DocumentSummary] = None
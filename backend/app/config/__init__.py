@@ -15,17 +15,42 @@ class Settings(BaseSettings):
     # Vector Store
     vector_store: str = "CHROMA"
     chroma_db_path: str = "./data/chroma"
+    faiss_hnsw_m: int = 32
+    faiss_hnsw_ef_construction: int = 200
+    faiss_hnsw_ef_search: int = 64
+    # Document-filtered searches over at most this many chunks are scored exactly
+    faiss_filter_exact_max_rows: int = 4096
+    # FAISS vector storage: "fp16" (half the memory) or "flat" (float32)
+    faiss_hnsw_storage: str = "fp16"
+    # Adds between FAISS index snapshots (metadata is appended on every add)
+    faiss_snapshot_every: int = 8
+    # Rebuild the FAISS index once this fraction of its vectors is deleted
+    faiss_compact_deleted_ratio: float = 0.2
+    # Seconds shutdown waits for a running FAISS compaction to finish
+    faiss_compact_shutdown_timeout: float = 60.0
+    # OpenMP threads for FAISS (0 = all cores)
+    faiss_omp_threads: int = 0
+    # Vectors converted and added to FAISS per step (bounds temporary memory)
+    faiss_add_tile_rows: int = 8192
     
     # Chunking
     max_chunk_tokens: int = 700
     chunk_overlap_tokens: int = 100
     top_k: int = 5
     
+    # Embeddings
+    embedding_batch_size: int = 64
+    embedding_cache_enabled: bool = True
+    embedding_cache_dir: str = "./data/embedding_cache"
+    
     # Data Directories
     data_dir: str = "./data"
     raw_docs_dir: str = "./data/raw"
     library_dir: str = "./data/library"
     processed_files_tracker: str = "./data/processed_files_tracker.json"
+    library_max_workers: int = 4
+    pdf_parse_workers: int = 4
+    ocr_workers: int = 4
     
     # Logging
     log_level: str = "INFO"
@@ -44,6 +69,11 @@ class Settings(BaseSettings):
     max_context_tokens: int = 4000
     early_exit_confidence: float = 0.0
     
+    # Latest Tools
+    tools_skip_llm_filter: bool = False
+    tools_search_per_page: int = 30
+    github_token: Optional[str] = None
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -8,7 +8,7 @@ from pathlib import Path
 from app.config import settings
 from app.api import health, ingest, chat, documents, export
 from app.api.ingest import documents_store, persist_documents_store
-from app.services.library_processor import LibraryProcessor
+from app.services.library_processor import get_library_processor
 from app.services.document_store_loader import load_documents_store
 from app.database import init_db
 
@@ -60,6 +60,10 @@ async def startup_event():
     
     logger.info("Starting application startup sequence...")
     
+    # Initialize guardrails in the background so the first chat request
+    # doesn't wait for it
+    chat.rag_service.start_guardrails_init()
+    
     # Initialize database
     try:
         init_db()
@@ -86,8 +90,9 @@ async def startup_event():
     
     # Step 2: Reconstruct any missing documents from tracker
     logger.info("Reconstructing documents from processed files tracker...")
+    processor = None
     try:
-        processor = LibraryProcessor()
+        processor = get_library_processor()
         recon_stats = await loop.run_in_executor(
             None, 
             processor.reconstruct_documents_store_from_tracker
@@ -102,7 +107,8 @@ async def startup_event():
     # Step 3: Process library folder for new/unprocessed files
     logger.info("Processing library folder for new files...")
     try:
-        processor = LibraryProcessor()
+        if processor is None:
+            processor = get_library_processor()
         stats = await loop.run_in_executor(None, processor.scan_and_process)
         logger.info(f"Library processing complete: {stats}")
     except Exception as e:
@@ -122,6 +128,16 @@ async def startup_event():
     logger.info(f"Startup complete. Total documents in store: {len(documents_store)}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release long-lived client resources."""
+    from app.services.tools_agent import close_tools_agent
+    from app.services.vector_store import flush_vector_stores
+    
+    await close_tools_agent()
+    flush_vector_stores()
+
+
 @app.get("/")
 async def root():
     """Root endpoint."""
@@ -139,10 +139,10 @@ def load_documents_store_from_tracker() -> Dict[str, Any]:
         Dictionary of doc_id -> document metadata
     """
     # Import here to avoid circular import
-    from app.services.library_processor import LibraryProcessor
+    from app.services.library_processor import get_library_processor
     
     documents = {}
-    processor = LibraryProcessor()
+    processor = get_library_processor()
     processed_files = processor.get_processed_files()
     
     if not processed_files:
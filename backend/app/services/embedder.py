@@ -1,7 +1,9 @@
 """Embedding service wrapper."""
 import logging
-from typing import List
+from typing import List, Optional
 
+from app.config import settings
+from app.services.embedding_cache import EmbeddingCache
 from app.services.model_adapter import get_model_adapter
 
 logger = logging.getLogger(__name__)
@@ -12,6 +14,16 @@ class Embedder:
     
     def __init__(self):
         self.model_adapter = get_model_adapter()
+        self.batch_size = max(1, settings.embedding_batch_size)
+        self._dimension: Optional[int] = None
+        
+        self.cache: Optional[EmbeddingCache] = None
+        if settings.embedding_cache_enabled:
+            model = getattr(self.model_adapter, 'embedding_model', type(self.model_adapter).__name__)
+            try:
+                self.cache = EmbeddingCache(settings.embedding_cache_dir, model)
+            except Exception as e:
+                logger.warning(f"Embedding cache unavailable: {e}")
     
     def get_embedding(self, text: str) -> List[float]:
         """Get embedding for text."""
@@ -30,23 +42,77 @@ class Embedder:
             raise
     
     def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        """Get embeddings for multiple texts (sequential for now)."""
-        embeddings = []
-        for text in texts:
-            try:
-                embedding = self.get_embedding(text)
-                embeddings.append(embedding)
-            except Exception as e:
-                logger.error(f"Error getting embedding for text: {e}")
-                # Use zero vector as fallback
-                if embeddings:
-                    embeddings.append([0.0] * len(embeddings[0]))
-                else:
-                    # Default dimension if we can't determine
-                    embeddings.append([0.0] * 4096)
+        """
+        Get embeddings for multiple texts.
+        
+        Cached embeddings are reused; the remaining texts are sorted by length
+        and embedded in mini-batches of ``batch_size`` so each batch holds
+        similarly sized inputs and pads less. Results are returned in the
+        original order.
+        """
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        
+        keys = None
+        if self.cache:
+            keys = [self.cache.key(text) for text in texts]
+            hits = self.cache.get_many(keys)
+            for i, key in enumerate(keys):
+                embeddings[i] = hits.get(key)
+        
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        order = sorted(misses, key=lambda i: len(texts[i]))
+        new_entries = {}
+        
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            batch_embeddings = self._embed_batch([texts[i] for i in batch])
+            for i, embedding in zip(batch, batch_embeddings):
+                embeddings[i] = embedding
+                # Skip empty and zero-vector fallbacks
+                if keys is not None and any(embedding):
+                    new_entries[keys[i]] = embedding
+        
+        if new_entries:
+            self.cache.put_many(new_entries)
+        
+        return embeddings
+    
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed one length-bucketed mini-batch with a single adapter call."""
+        normalized = [self._normalize_text(text) for text in texts]
+        valid = [i for i, text in enumerate(normalized) if len(text) >= 10]
+        if len(valid) < len(texts):
+            logger.warning(f"{len(texts) - len(valid)} text(s) too short for embedding")
+        
+        embeddings: List[List[float]] = [[] for _ in texts]
+        if not valid:
+            return embeddings
+        
+        try:
+            batch_embeddings = self.model_adapter.get_embeddings([normalized[i] for i in valid])
+        except Exception as e:
+            logger.warning(f"Batch embedding failed, embedding texts one at a time: {e}")
+            return [self._embed_one(text) for text in texts]
+        
+        for i, embedding in zip(valid, batch_embeddings):
+            embeddings[i] = embedding
+            if embedding:
+                self._dimension = len(embedding)
         
         return embeddings
     
+    def _embed_one(self, text: str) -> List[float]:
+        """Embed a single text, falling back to a zero vector on error."""
+        try:
+            embedding = self.get_embedding(text)
+            if embedding:
+                self._dimension = len(embedding)
+            return embedding
+        except Exception as e:
+            logger.error(f"Error getting embedding for text: {e}")
+            # Use zero vector as fallback (default dimension if we can't determine)
+            return [0.0] * (self._dimension or 4096)
+    
     def _normalize_text(self, text: str) -> str:
         """Normalize text before embedding."""
         # Remove excessive whitespace
@@ -0,0 +1,76 @@
+"""Persistent embedding cache keyed by model and chunk-text hash."""
+import hashlib
+import logging
+import sqlite3
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Stay below SQLite's default limit on bound parameters per statement
+_MAX_PARAMS = 500
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed embedding cache.
+
+    An embedding is a pure function of (model, text), so unchanged chunks of
+    a re-processed document can skip the model entirely. Vectors are stored
+    as packed float32.
+    """
+
+    def __init__(self, cache_dir: str, model: str):
+        path = Path(cache_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        self.model = model
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(path / "embeddings.sqlite3"),
+            timeout=30,
+            check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def key(self, text: str) -> bytes:
+        """Cache key for a text under this cache's model."""
+        return hashlib.sha1(f"{self.model}\0{text}".encode()).digest()
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, List[float]]:
+        """Return cached embeddings for whichever keys are present."""
+        found: Dict[bytes, List[float]] = {}
+        try:
+            with self._lock:
+                for start in range(0, len(keys), _MAX_PARAMS):
+                    batch = list(keys[start:start + _MAX_PARAMS])
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                        batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        found[key] = array('f', blob).tolist()
+        except sqlite3.Error as e:
+            logger.warning(f"Error reading embedding cache: {e}")
+        return found
+
+    def put_many(self, items: Dict[bytes, List[float]]):
+        """Store embeddings by key."""
+        if not items:
+            return
+        rows = [(key, array('f', vector).tobytes()) for key, vector in items.items()]
+        try:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    rows
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Error writing embedding cache: {e}")
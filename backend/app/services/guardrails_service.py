@@ -2,6 +2,7 @@
 
 import logging
 import os
+import re
 import time
 import hashlib
 from typing import Optional, Dict, Any, List, Tuple
@@ -23,6 +24,48 @@ from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Fast-path keyword tables, compiled once into single alternations so each
+# query is scanned in one pass per table instead of once per keyword.
+_SAFE_PATTERNS = (
+    "what", "how", "where", "when", "which", "who",
+    "explain", "describe", "list", "show", "give",
+    "summary", "architecture", "component", "technology",
+    "document", "file", "page", "section"
+)
+_MALICIOUS_PATTERNS = (
+    "hack", "exploit", "bypass", "override", "ignore previous",
+    "malicious", "virus", "trojan"
+)
+_SAFE_RE = re.compile("|".join(map(re.escape, _SAFE_PATTERNS)))
+_MALICIOUS_RE = re.compile("|".join(map(re.escape, _MALICIOUS_PATTERNS)))
+
+
+def _fast_path(query: str, enabled: bool = True) -> Tuple[Optional[bool], str, str]:
+    """
+    Fused input fast path: normalize the query once, derive its cache key and
+    pre-screen it against the safe/malicious keyword tables.
+    
+    Returns:
+        Tuple of (is_valid, message, cache_key); is_valid is None when the
+        query needs full validation.
+    """
+    query_lower = query.lower().strip()
+    cache_key = hashlib.md5(f"input:{query_lower}".encode()).hexdigest()
+    
+    if not enabled:
+        return None, "", cache_key
+    
+    # Very short queries are usually safe
+    if len(query) < 10:
+        return True, "", cache_key
+    
+    # Common document analysis queries are safe unless they carry an
+    # obvious malicious pattern
+    if _SAFE_RE.search(query_lower) and not _MALICIOUS_RE.search(query_lower):
+        return True, "", cache_key
+    
+    return None, "", cache_key
+
 
 class GuardrailsService:
     """Service to wrap LLM calls with NeMo Guardrails or custom validation."""
@@ -153,34 +196,10 @@ class GuardrailsService:
     
     def _fast_path_check(self, query: str) -> Optional[Tuple[bool, str]]:
         """Fast path validation for obviously safe queries."""
-        if not self.fast_path_enabled:
+        is_valid, message, _ = _fast_path(query, self.fast_path_enabled)
+        if is_valid is None:
             return None
-        
-        query_lower = query.lower().strip()
-        
-        # Very short queries are usually safe
-        if len(query) < 10:
-            return True, ""
-        
-        # Common document analysis queries are safe
-        safe_patterns = [
-            "what", "how", "where", "when", "which", "who",
-            "explain", "describe", "list", "show", "give",
-            "summary", "architecture", "component", "technology",
-            "document", "file", "page", "section"
-        ]
-        
-        if any(pattern in query_lower for pattern in safe_patterns):
-            # Quick check for obvious malicious patterns
-            malicious_patterns = [
-                "hack", "exploit", "bypass", "override", "ignore previous",
-                "malicious", "virus", "trojan"
-            ]
-            
-            if not any(pattern in query_lower for pattern in malicious_patterns):
-                return True, ""
-        
-        return None
+        return is_valid, message
     
     def validate_input(self, query: str) -> Tuple[bool, str]:
         """
@@ -194,12 +213,15 @@ class GuardrailsService:
         if not self.enabled:
             return True, ""
         
+        # Normalize, hash and pre-screen the query in a single pass
+        fast_valid, fast_message, cache_key = _fast_path(query, self.fast_path_enabled)
+        
         # Check cache first
         if self.cache_enabled:
-            cache_key = self._get_cache_key(query, "input")
             self._clean_cache()
-            if cache_key in self._validation_cache:
-                is_valid, message, _ = self._validation_cache[cache_key]
+            cached = self._validation_cache.get(cache_key)
+            if cached is not None:
+                is_valid, message, _ = cached
                 self._cache_hits += 1
                 elapsed = time.time() - start_time
                 self._validation_times.append(elapsed)
@@ -208,9 +230,8 @@ class GuardrailsService:
             self._cache_misses += 1
         
         # Fast path optimization
-        fast_result = self._fast_path_check(query)
-        if fast_result is not None:
-            is_valid, message = fast_result
+        if fast_valid is not None:
+            is_valid, message = fast_valid, fast_message
             if self.cache_enabled:
                 self._validation_cache[cache_key] = (is_valid, message, time.time())
             elapsed = time.time() - start_time
@@ -1,9 +1,14 @@
 """Library folder processor for auto-ingesting PDFs on startup."""
+import os
 import json
 import hashlib
 import logging
+import multiprocessing
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime
 
 from app.config import settings
@@ -17,6 +22,9 @@ from app.schemas import DocumentMetadata, DocumentSummary
 
 logger = logging.getLogger(__name__)
 
+# Pool results committed to the vector store per insert
+LIBRARY_COMMIT_BATCH = 8
+
 
 class LibraryProcessor:
     """Processes PDFs from the library folder on startup."""
@@ -26,201 +34,269 @@ class LibraryProcessor:
         self.tracker_file = Path(settings.processed_files_tracker)
         self.library_dir.mkdir(parents=True, exist_ok=True)
         self.tracker_file.parent.mkdir(parents=True, exist_ok=True)
+        
+        # Pipeline components shared by every file this processor handles;
+        # created on first use so tracker-only callers don't build them
+        self._parser: Optional[DocumentParser] = None
+        self._chunker: Optional[TextChunker] = None
+        self._embedder: Optional[Embedder] = None
+        self._vector_store: Optional[VectorStore] = None
+        
+        # In-memory copy of the tracker; writes are batched until flush_tracker()
+        self._processed_cache: Optional[Dict[str, dict]] = None
+        self._processed_mtime_ns: Optional[int] = None
+        self._tracker_dirty = False
+        self._tracker_lock = threading.RLock()
+    
+    @property
+    def parser(self) -> DocumentParser:
+        if self._parser is None:
+            self._parser = DocumentParser()
+        return self._parser
+    
+    @property
+    def chunker(self) -> TextChunker:
+        if self._chunker is None:
+            self._chunker = TextChunker()
+        return self._chunker
+    
+    @property
+    def embedder(self) -> Embedder:
+        if self._embedder is None:
+            self._embedder = Embedder()
+        return self._embedder
+    
+    @property
+    def vector_store(self) -> VectorStore:
+        if self._vector_store is None:
+            self._vector_store = VectorStore()
+        return self._vector_store
+    
+    def _tracker_mtime_ns(self) -> Optional[int]:
+        """Return the tracker file's mtime, or None if it doesn't exist."""
+        try:
+            return self.tracker_file.stat().st_mtime_ns
+        except OSError:
+            return None
     
     def get_processed_files(self) -> Dict[str, dict]:
-        """Load the processed files tracking JSON."""
-        if not self.tracker_file.exists():
-            return {}
+        """Load the processed files tracking JSON (cached until the file changes)."""
+        if self._processed_cache is not None:
+            # Unflushed changes win; otherwise reuse the cache while the file is unchanged
+            if self._tracker_dirty or self._tracker_mtime_ns() == self._processed_mtime_ns:
+                return self._processed_cache
         
-        try:
-            with open(self.tracker_file, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError) as e:
-            logger.warning(f"Error reading processed files tracker: {e}")
-            return {}
+        mtime_ns = self._tracker_mtime_ns()
+        if mtime_ns is None:
+            processed = {}
+        else:
+            try:
+                with open(self.tracker_file, 'r') as f:
+                    processed = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                logger.warning(f"Error reading processed files tracker: {e}")
+                processed = {}
+        
+        self._processed_cache = processed
+        self._processed_mtime_ns = mtime_ns
+        return processed
     
     def track_processed_file(self, file_path: Path, doc_id: str, file_hash: str):
-        """Mark a file as processed in the tracking JSON."""
-        processed = self.get_processed_files()
-        
+        """Mark a file as processed (written to disk on flush_tracker())."""
         # Use absolute path as key for consistency
         abs_path = str(file_path.absolute())
-        processed[abs_path] = {
+        entry = {
             'file_path': str(file_path),
             'file_hash': file_hash,
             'processed_at': datetime.now().isoformat(),
             'doc_id': doc_id
         }
-        
         try:
-            with open(self.tracker_file, 'w') as f:
-                json.dump(processed, f, indent=2)
-            logger.info(f"Tracked processed file: {file_path}")
-        except IOError as e:
-            logger.error(f"Error writing processed files tracker: {e}")
+            st = file_path.stat()
+            entry['file_size'] = st.st_size
+            entry['mtime_ns'] = st.st_mtime_ns
+        except OSError:
+            pass
+        with self._tracker_lock:
+            self.get_processed_files()[abs_path] = entry
+            self._tracker_dirty = True
+        logger.info(f"Tracked processed file: {file_path}")
+    
+    def remove_processed(self, doc_id: str) -> bool:
+        """
+        Drop a document's tracker entry (written to disk on flush_tracker()).
+        
+        Returns whether an entry was removed.
+        """
+        with self._tracker_lock:
+            processed = self.get_processed_files()
+            remaining = {
+                path: info for path, info in processed.items()
+                if info.get('doc_id') != doc_id
+            }
+            if len(remaining) == len(processed):
+                return False
+            # Replace rather than mutate, so readers iterating the old dict
+            # are unaffected
+            self._processed_cache = remaining
+            self._tracker_dirty = True
+        return True
+    
+    def flush_tracker(self):
+        """Atomically write pending tracker changes to disk."""
+        # Persist the index first so the tracker never gets ahead of it
+        if self._vector_store is not None:
+            self._vector_store.flush()
+        with self._tracker_lock:
+            if not self._tracker_dirty or self._processed_cache is None:
+                return
+            
+            tmp_file = self.tracker_file.with_suffix('.tmp')
+            try:
+                with open(tmp_file, 'w') as f:
+                    json.dump(self._processed_cache, f, indent=2)
+                os.replace(tmp_file, self.tracker_file)
+                self._processed_mtime_ns = self._tracker_mtime_ns()
+                self._tracker_dirty = False
+            except IOError as e:
+                logger.error(f"Error writing processed files tracker: {e}")
     
     def calculate_file_hash(self, file_path: Path) -> str:
         """Calculate SHA256 hash of a file."""
-        sha256 = hashlib.sha256()
         try:
-            with open(file_path, 'rb') as f:
-                for chunk in iter(lambda: f.read(4096), b""):
+            with open(file_path, 'rb', buffering=0) as f:
+                if hasattr(hashlib, 'file_digest'):
+                    # Python 3.11+: hashing loop runs in C
+                    return hashlib.file_digest(f, 'sha256').hexdigest()
+                sha256 = hashlib.sha256()
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
                     sha256.update(chunk)
-            return sha256.hexdigest()
+                return sha256.hexdigest()
         except IOError as e:
             logger.error(f"Error calculating file hash for {file_path}: {e}")
             return ""
     
-    def is_file_processed(self, file_path: Path) -> bool:
-        """Check if a file has already been processed."""
+    def is_file_processed(self, file_path: Path) -> Tuple[bool, str]:
+        """
+        Check if a file has already been processed.
+        
+        Returns:
+            Tuple of (processed, file_hash); the hash is computed at most
+            once per check and can be passed on to track_processed_file.
+        """
         processed = self.get_processed_files()
         abs_path = str(file_path.absolute())
         
         if abs_path not in processed:
-            return False
+            return False, self.calculate_file_hash(file_path)
+        
+        # Unchanged size and mtime: same file, no need to hash it
+        stored = processed[abs_path]
+        stored_hash = stored.get('file_hash', '')
+        st = file_path.stat()
+        if st.st_size == stored.get('file_size') and st.st_mtime_ns == stored.get('mtime_ns'):
+            return True, stored_hash
         
         # Check if file hash matches (file hasn't changed)
-        stored_hash = processed[abs_path].get('file_hash', '')
         current_hash = self.calculate_file_hash(file_path)
         
         if stored_hash and current_hash == stored_hash:
-            return True
+            # Content unchanged (e.g. touched or copied); refresh the fast identity key
+            with self._tracker_lock:
+                stored['file_size'] = st.st_size
+                stored['mtime_ns'] = st.st_mtime_ns
+                self._tracker_dirty = True
+            return True, current_hash
         
         # File exists but hash changed, so reprocess
         logger.info(f"File {file_path} hash changed, will reprocess")
-        return False
+        return False, current_hash
     
     def process_pdf_file(self, file_path: Path) -> Optional[str]:
         """Process a single PDF file through the ingestion pipeline."""
-        import uuid
-        
         try:
             # Check if already processed
-            if self.is_file_processed(file_path):
+            processed, file_hash = self.is_file_processed(file_path)
+            if processed:
                 logger.info(f"Skipping already processed file: {file_path}")
+                self.flush_tracker()
                 return None
             
-            logger.info(f"Processing library file: {file_path}")
-            
-            # Generate document ID
-            doc_id = str(uuid.uuid4())
-            
-            # Create document directory in raw_docs_dir
-            doc_dir = Path(settings.raw_docs_dir) / doc_id
-            doc_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Copy file to raw_docs_dir
-            file_ext = file_path.suffix
-            original_path = doc_dir / f"original{file_ext}"
-            
-            import shutil
-            shutil.copy2(file_path, original_path)
-            
-            # Parse document
-            parser = DocumentParser()
-            text, page_count, image_paths = parser.parse(str(original_path), doc_id)
-            text = parser.clean_text(text)
-            
-            if not text or len(text.strip()) < 50:
-                logger.warning(f"Document {file_path} contains too little text, skipping")
-                return None
-            
-            # Chunk text
-            chunker = TextChunker()
-            metadata = {
-                'owner': None,
-                'project': None,
-                'tags': [],
-                'filename': file_path.name
-            }
-            
-            # For multi-page documents, chunk per page
-            chunks = []
-            if page_count > 1:
-                pages = text.split("--- Page")
-                for page_num, page_text in enumerate(pages[1:], 1):
-                    page_chunks = chunker.chunk_text(page_text, doc_id, page_num, metadata)
-                    chunks.extend(page_chunks)
-            else:
-                chunks = chunker.chunk_text(text, doc_id, 1, metadata)
-            
-            # Add filename to chunks
-            for chunk in chunks:
-                chunk['filename'] = file_path.name
-            
-            if not chunks:
-                logger.warning(f"Document {file_path} produced no chunks, skipping")
-                return None
-            
-            # Generate embeddings
-            embedder = Embedder()
-            chunk_texts = [chunk['text'] for chunk in chunks]
-            embeddings = embedder.get_embeddings_batch(chunk_texts)
+            doc_id = self._ingest_and_commit(file_path, file_hash)
             
-            # Store in vector DB
-            vector_store = VectorStore()
-            vector_store.add_chunks(chunks, embeddings)
-            
-            # Generate summary using RAG
-            rag_service = RAGService()
-            summary_query = "Provide a 3-sentence summary of this document, list key technologies mentioned, identify focus areas for penetration testing, and suggest use cases."
-            
-            # Use first few chunks for summary
-            summary_chunks = chunks[:min(5, len(chunks))]
-            summary_context = "\n\n".join([c['text'] for c in summary_chunks])
-            
-            try:
-                summary_text = rag_service.model_adapter.generate_text(
-                    prompt=f"Document content:\n{summary_context}\n\n{summary_query}",
-                    system="You are a security analyst. Provide concise summaries.",
-                    max_tokens=500,
-                    temperature=0.5
-                )
-            except Exception as e:
-                logger.warning(f"Failed to generate summary: {e}")
-                summary_text = "Summary generation failed."
-            
-            # Extract technologies
-            technologies = rag_service.extract_technologies(text)
-            
-            # Create document summary
-            summary = DocumentSummary(
-                summary=summary_text,
-                technologies=technologies,
-                focus_areas=["Authentication", "Network Security", "Data Protection"],
-                use_cases=["Penetration Testing", "Security Audit"]
-            )
-            
-            # Store document metadata
-            documents_store[doc_id] = {
-                'doc_id': doc_id,
-                'filename': file_path.name,
-                'file_type': file_ext,
-                'pages': page_count,
-                'chunks': len(chunks),
-                'summary': summary,
-                'metadata': DocumentMetadata(owner=None, project=None, tags=[]),
-                'file_path': str(original_path)
-            }
-            
-            # Track as processed
-            file_hash = self.calculate_file_hash(file_path)
-            self.track_processed_file(file_path, doc_id, file_hash)
-            
-            # Persist documents_store after processing
-            try:
-                from app.api.ingest import persist_documents_store
-                persist_documents_store()
-            except Exception as e:
-                logger.warning(f"Failed to persist documents_store after processing: {e}")
+            # Persist tracker and documents_store after processing
+            if doc_id:
+                self.flush_tracker()
+                try:
+                    from app.api.ingest import persist_documents_store
+                    persist_documents_store()
+                except Exception as e:
+                    logger.warning(f"Failed to persist documents_store after processing: {e}")
             
-            logger.info(f"Successfully processed library file: {file_path} (doc_id: {doc_id}, chunks: {len(chunks)})")
             return doc_id
             
         except Exception as e:
             logger.error(f"Error processing library file {file_path}: {e}", exc_info=True)
             return None
     
+    def _ingest_and_commit(self, file_path: Path, file_hash: str) -> Optional[str]:
+        """Run the ingestion pipeline in-process and commit its result."""
+        result = _ingest_pdf(file_path, file_hash, self.parser, self.chunker, self.embedder)
+        if not result:
+            return None
+        return self._commit_ingested(result)
+    
+    def _commit_ingested(self, result: Dict[str, Any]) -> str:
+        """Write an ingestion result to the shared stores."""
+        return self._commit_ingested_many([result])[0]
+    
+    def _commit_ingested_many(self, results: List[Dict[str, Any]]) -> List[str]:
+        """
+        Write ingestion results to the shared stores, adding all of their
+        chunks to the vector store in one insert.
+        
+        Only ever called from the parent process so the vector store,
+        documents_store and tracker are never mutated concurrently.
+        """
+        # Store in vector DB
+        self.vector_store.add_chunks_many([(result['chunks'], result['embeddings']) for result in results])
+        return [self._record_ingested(result) for result in results]
+    
+    def _commit_batch(self, results: List[Dict[str, Any]], stats: Dict[str, int]):
+        """Commit a batch of pool results, counting them in stats."""
+        if not results:
+            return
+        try:
+            stats['processed'] += len(self._commit_ingested_many(results))
+        except Exception as e:
+            sources = ", ".join(result['source_path'] for result in results)
+            logger.error(f"Error committing {sources}: {e}", exc_info=True)
+            stats['errors'] += len(results)
+    
+    def _record_ingested(self, result: Dict[str, Any]) -> str:
+        """Record a result, once its chunks are stored, in documents_store and the tracker."""
+        doc_id = result['doc_id']
+        chunks = result['chunks']
+        
+        # Store document metadata
+        documents_store[doc_id] = {
+            'doc_id': doc_id,
+            'filename': result['filename'],
+            'file_type': result['file_type'],
+            'pages': result['pages'],
+            'chunks': len(chunks),
+            'summary': result['summary'],
+            'metadata': DocumentMetadata(owner=None, project=None, tags=[]),
+            'file_path': result['file_path']
+        }
+        
+        # Track as processed
+        source_path = Path(result['source_path'])
+        self.track_processed_file(source_path, doc_id, result['file_hash'])
+        
+        logger.info(f"Successfully processed library file: {source_path} (doc_id: {doc_id}, chunks: {len(chunks)})")
+        return doc_id
+    
     def reconstruct_documents_store_from_tracker(self) -> Dict[str, int]:
         """
         Reconstruct documents_store entries for already-processed files.
@@ -236,8 +312,7 @@ class LibraryProcessor:
             logger.info("No processed files in tracker to reconstruct")
             return stats
         
-        vector_store = VectorStore()
-        doc_info_from_vector = vector_store.get_all_document_ids()
+        doc_info_from_vector = self.vector_store.get_all_document_ids()
         
         for file_path_str, file_info in processed_files.items():
             try:
@@ -321,17 +396,239 @@ class LibraryProcessor:
         
         logger.info(f"Found {len(pdf_files)} PDF file(s) in library directory")
         
+        # Hash and skip already-processed files up front so only new work
+        # is handed to the pool
+        pending = []
         for pdf_file in pdf_files:
             try:
-                doc_id = self.process_pdf_file(pdf_file)
-                if doc_id:
-                    stats['processed'] += 1
-                else:
+                processed, file_hash = self.is_file_processed(pdf_file)
+                if processed:
+                    logger.info(f"Skipping already processed file: {pdf_file}")
                     stats['skipped'] += 1
+                else:
+                    pending.append((pdf_file, file_hash))
             except Exception as e:
-                logger.error(f"Error processing {pdf_file}: {e}", exc_info=True)
+                logger.error(f"Error checking {pdf_file}: {e}", exc_info=True)
                 stats['errors'] += 1
         
+        if not pending:
+            logger.info(f"Library processing complete: {stats}")
+            return stats
+        
+        max_workers = min(os.cpu_count() or 1, settings.library_max_workers, len(pending))
+        
+        if max_workers <= 1:
+            for pdf_file, file_hash in pending:
+                try:
+                    doc_id = self._ingest_and_commit(pdf_file, file_hash)
+                    if doc_id:
+                        stats['processed'] += 1
+                    else:
+                        stats['skipped'] += 1
+                except Exception as e:
+                    logger.error(f"Error processing {pdf_file}: {e}", exc_info=True)
+                    stats['errors'] += 1
+        else:
+            # Parsing, OCR and embedding run in worker processes; results are
+            # committed here as they complete
+            logger.info(f"Processing {len(pending)} PDF file(s) with {max_workers} workers")
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(max_workers,)
+            ) as executor:
+                futures = {
+                    executor.submit(_ingest_pdf_in_worker, str(pdf_file), file_hash): pdf_file
+                    for pdf_file, file_hash in pending
+                }
+                # Results are committed in batches so the vector store
+                # inserts several documents' chunks at once
+                batch = []
+                for future in as_completed(futures):
+                    pdf_file = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Error processing {pdf_file}: {e}", exc_info=True)
+                        stats['errors'] += 1
+                        continue
+                    if not result:
+                        stats['skipped'] += 1
+                        continue
+                    batch.append(result)
+                    if len(batch) >= LIBRARY_COMMIT_BATCH:
+                        self._commit_batch(batch, stats)
+                        batch = []
+                self._commit_batch(batch, stats)
+        
+        # Persist tracker and documents_store once for the whole scan
+        self.flush_tracker()
+        if stats['processed'] > 0:
+            try:
+                from app.api.ingest import persist_documents_store
+                persist_documents_store()
+            except Exception as e:
+                logger.warning(f"Failed to persist documents_store after library scan: {e}")
+        
         logger.info(f"Library processing complete: {stats}")
         return stats
 
+
+# Global instance: the single owner (and writer) of the tracker file
+_library_processor = None
+_library_processor_lock = threading.Lock()
+
+
+def get_library_processor() -> LibraryProcessor:
+    """Get or create the library processor instance."""
+    global _library_processor
+    with _library_processor_lock:
+        if _library_processor is None:
+            _library_processor = LibraryProcessor()
+        return _library_processor
+
+
+# ioctl request cloning one file's extents into another (linux/fs.h)
+_FICLONE = 0x40049409
+
+
+def _copy_original(src: Path, dst: Path):
+    """
+    Copy src to dst, as a reflink where the filesystem supports one. The
+    copy never shares data with the library file, so editing that file in
+    place cannot change the archived original.
+    """
+    try:
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+    except (ImportError, OSError):
+        # No reflinks here; copy2 uses sendfile/copy_file_range on Linux
+        shutil.copy2(src, dst)
+
+
+def _ingest_pdf(
+    file_path: Path,
+    file_hash: str,
+    parser: DocumentParser,
+    chunker: TextChunker,
+    embedder: Embedder
+) -> Optional[Dict[str, Any]]:
+    """
+    Copy, parse, chunk, embed and summarize a library PDF.
+    
+    Touches no shared state, so it is safe to run in a worker process. Returns
+    a picklable payload for LibraryProcessor._commit_ingested, or None if the
+    document has no usable text.
+    """
+    import uuid
+    
+    logger.info(f"Processing library file: {file_path}")
+    
+    # Generate document ID
+    doc_id = str(uuid.uuid4())
+    
+    # Create document directory in raw_docs_dir
+    doc_dir = Path(settings.raw_docs_dir) / doc_id
+    doc_dir.mkdir(parents=True, exist_ok=True)
+    
+    # Copy file to raw_docs_dir
+    file_ext = file_path.suffix
+    original_path = doc_dir / f"original{file_ext}"
+    _copy_original(file_path, original_path)
+    
+    # Parse document
+    text, page_count, image_paths, pages = parser.parse(str(original_path), doc_id)
+    text = parser.clean_text(text)
+    
+    if not text or len(text.strip()) < 50:
+        logger.warning(f"Document {file_path} contains too little text, skipping")
+        return None
+    
+    # Chunk text
+    metadata = {
+        'owner': None,
+        'project': None,
+        'tags': [],
+        'filename': file_path.name
+    }
+    
+    # Chunk per page
+    chunks = []
+    for page_num, page_text in enumerate(pages, 1):
+        chunks.extend(chunker.chunk_text(parser.clean_text(page_text), doc_id, page_num, metadata))
+    
+    # Add filename to chunks
+    for chunk in chunks:
+        chunk['filename'] = file_path.name
+    
+    if not chunks:
+        logger.warning(f"Document {file_path} produced no chunks, skipping")
+        return None
+    
+    # Generate embeddings
+    chunk_texts = [chunk['text'] for chunk in chunks]
+    embeddings = embedder.get_embeddings_batch(chunk_texts)
+    
+    # Generate summary from the first few chunks
+    summary_query = "Provide a 3-sentence summary of this document, list key technologies mentioned, identify focus areas for penetration testing, and suggest use cases."
+    summary_chunks = chunks[:min(5, len(chunks))]
+    summary_context = "\n\n".join([c['text'] for c in summary_chunks])
+    
+    try:
+        summary_text = embedder.model_adapter.generate_text(
+            prompt=f"Document content:\n{summary_context}\n\n{summary_query}",
+            system="You are a security analyst. Provide concise summaries.",
+            max_tokens=500,
+            temperature=0.5
+        )
+    except Exception as e:
+        logger.warning(f"Failed to generate summary: {e}")
+        summary_text = "Summary generation failed."
+    
+    # Create document summary
+    summary = DocumentSummary(
+        summary=summary_text,
+        technologies=RAGService.extract_technologies(text),
+        focus_areas=["Authentication", "Network Security", "Data Protection"],
+        use_cases=["Penetration Testing", "Security Audit"]
+    )
+    
+    return {
+        'doc_id': doc_id,
+        'source_path': str(file_path),
+        'file_hash': file_hash,
+        'filename': file_path.name,
+        'file_type': file_ext,
+        'file_path': str(original_path),
+        'pages': page_count,
+        'chunks': chunks,
+        'embeddings': embeddings,
+        'summary': summary
+    }
+
+
+def _init_worker(pool_workers: int):
+    """
+    Process pool initializer: split the CPU budget across the pool. Each
+    worker already parses a whole document, so it extracts PDF pages
+    in-process rather than spawning a nested page pool, and gets its share
+    of the OCR threads. Settings are per process, so the parent is
+    unaffected.
+    """
+    settings.pdf_parse_workers = 1
+    settings.ocr_workers = max(1, min(settings.ocr_workers, (os.cpu_count() or 1) // pool_workers))
+
+
+# Parser/chunker/embedder for the current pool worker, built on first use
+_worker_components: Optional[Tuple[DocumentParser, TextChunker, Embedder]] = None
+
+
+def _ingest_pdf_in_worker(file_path: str, file_hash: str) -> Optional[Dict[str, Any]]:
+    """Process pool entry point; reuses the worker's components across files."""
+    global _worker_components
+    if _worker_components is None:
+        _worker_components = (DocumentParser(), TextChunker(), Embedder())
+    return _ingest_pdf(Path(file_path), file_hash, *_worker_components)
@@ -2,6 +2,7 @@
 import os
 import logging
 import requests
+from requests.adapters import HTTPAdapter
 from typing import List, Optional
 from abc import ABC, abstractmethod
 
@@ -18,6 +19,10 @@ class ModelAdapter(ABC):
         """Get embedding vector for text."""
         pass
     
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Get embedding vectors for several texts (one call per text by default)."""
+        return [self.get_embedding(text) for text in texts]
+    
     @abstractmethod
     def generate_text(
         self,
@@ -42,6 +47,10 @@ class OllamaAdapter(ModelAdapter):
         self.host = host or settings.ollama_host
         self.model = model or settings.ollama_model
         self.embedding_model = f"{self.model}"  # Ollama uses same model for embeddings
+        
+        # Keep-alive connection pool to the Ollama host
+        self._session = requests.Session()
+        self._session.mount(self.host, HTTPAdapter(pool_connections=4, pool_maxsize=16))
     
     def get_embedding(self, text: str) -> List[float]:
         """Get embedding from Ollama."""
@@ -51,7 +60,7 @@ class OllamaAdapter(ModelAdapter):
                 "model": self.embedding_model,
                 "prompt": text
             }
-            response = requests.post(url, json=payload, timeout=30)
+            response = self._session.post(url, json=payload, timeout=30)
             response.raise_for_status()
             data = response.json()
             return data.get("embedding", [])
@@ -59,6 +68,27 @@ class OllamaAdapter(ModelAdapter):
             logger.error(f"Error getting embedding from Ollama: {e}")
             raise
     
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Get embeddings for a batch of texts in one request via /api/embed."""
+        if not texts:
+            return []
+        try:
+            url = f"{self.host}/api/embed"
+            payload = {
+                "model": self.embedding_model,
+                "input": texts
+            }
+            response = self._session.post(url, json=payload, timeout=120)
+            response.raise_for_status()
+            data = response.json()
+            embeddings = data.get("embeddings", [])
+            if len(embeddings) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+            return embeddings
+        except Exception as e:
+            logger.error(f"Error getting batch embeddings from Ollama: {e}")
+            raise
+    
     def generate_text(
         self,
         prompt: str,
@@ -79,7 +109,7 @@ class OllamaAdapter(ModelAdapter):
                 },
                 "stream": False
             }
-            response = requests.post(url, json=payload, timeout=120)
+            response = self._session.post(url, json=payload, timeout=120)
             response.raise_for_status()
             data = response.json()
             return data.get("response", "")
@@ -91,7 +121,7 @@ class OllamaAdapter(ModelAdapter):
         """Check if Ollama is available."""
         try:
             url = f"{self.host}/api/tags"
-            response = requests.get(url, timeout=5)
+            response = self._session.get(url, timeout=5)
             response.raise_for_status()
             return True
         except Exception as e:
@@ -1,20 +1,129 @@
 """Document parser for PDF, Word, HTML, and images."""
+import atexit
+import io
 import os
 import logging
+import multiprocessing
+import re
+import threading
 import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Tuple, Optional
-import pdfplumber
-import docx
-from bs4 import BeautifulSoup
-from PIL import Image
-import pytesseract
-import fitz  # PyMuPDF
 
 from app.config import settings
 
+# Parsing/OCR libraries (pdfplumber, PyMuPDF, python-docx, bs4, Pillow,
+# tesserocr/pytesseract) are imported inside the functions that use them, so
+# processes that only serve chat never load them.
+
 logger = logging.getLogger(__name__)
 
+# PDFs with at least this many pages are extracted in a process pool
+PARALLEL_PAGE_THRESHOLD = 16
+
+# clean_text patterns: lines of fewer than 3 characters containing a digit,
+# and runs of whitespace within a line
+_SHORT_NUMERIC_LINE_RE = re.compile(r'^[^\S\n]*(?:\d\S?|\S\d)[^\S\n]*$', re.M)
+_WS_RE = re.compile(r'[^\S\n]+')
+
+
+_tess_local = threading.local()
+
+# OCR threads live for the whole process so their tesserocr engines are
+# reused across documents; created on first use with settings.ocr_workers
+_ocr_executor: Optional[ThreadPoolExecutor] = None
+_ocr_executor_lock = threading.Lock()
+
+
+def _get_tess_api():
+    """
+    Return this thread's long-lived tesserocr API, or None if tesserocr is
+    not installed.
+    
+    Keeping one initialized engine per thread avoids pytesseract's
+    tesseract subprocess (and model load) for every image.
+    """
+    if not hasattr(_tess_local, "api"):
+        try:
+            import tesserocr
+            _tess_local.api = tesserocr.PyTessBaseAPI()
+        except ImportError:
+            _tess_local.api = None
+        except Exception as e:
+            logger.warning(f"Failed to initialize tesserocr, falling back to pytesseract: {e}")
+            _tess_local.api = None
+    return _tess_local.api
+
+
+def _image_to_string(image) -> str:
+    """OCR a PIL image with tesserocr when available, else pytesseract."""
+    api = _get_tess_api()
+    if api is not None:
+        api.SetImage(image)
+        return api.GetUTF8Text()
+    
+    import pytesseract
+    return pytesseract.image_to_string(image)
+
+
+def _ocr_image(image_bytes: bytes) -> str:
+    """OCR a single in-memory image, returning an empty string on failure."""
+    from PIL import Image
+    
+    try:
+        return _image_to_string(Image.open(io.BytesIO(image_bytes)))
+    except Exception as e:
+        logger.warning(f"OCR failed for image: {e}")
+        return ""
+
+
+def _get_ocr_executor() -> ThreadPoolExecutor:
+    """Return the process-wide OCR thread pool, creating it on first use."""
+    global _ocr_executor
+    with _ocr_executor_lock:
+        if _ocr_executor is None:
+            _ocr_executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.ocr_workers),
+                thread_name_prefix="ocr"
+            )
+            atexit.register(_ocr_executor.shutdown)
+        return _ocr_executor
+
+
+def _ocr_images(images: List[bytes]) -> List[str]:
+    """
+    OCR a batch of in-memory images concurrently, preserving order.
+    
+    Both OCR backends do their work outside the GIL (tesserocr natively,
+    pytesseract in a tesseract subprocess), so threads are enough to keep
+    several images in flight at once.
+    """
+    if len(images) <= 1:
+        return [_ocr_image(image) for image in images]
+    return list(_get_ocr_executor().map(_ocr_image, images))
+
+
+def _extract_page(doc, page_index: int) -> Tuple[str, List[bytes]]:
+    """Extract text and raw image bytes from one page of an open PDF."""
+    page = doc[page_index]
+    images = []
+    for img in page.get_images():
+        try:
+            images.append(doc.extract_image(img[0])["image"])
+        except Exception as e:
+            logger.warning(f"Failed to extract image from PDF page {page_index + 1}: {e}")
+    return page.get_text(), images
+
+
+def _extract_pdf_pages(file_path: str, start: int, stop: int) -> List[Tuple[str, List[bytes]]]:
+    """Process pool entry point: extract pages [start, stop) with a single open."""
+    import fitz  # PyMuPDF
+    
+    with fitz.open(file_path) as doc:
+        return [_extract_page(doc, i) for i in range(start, stop)]
+
 
 class DocumentParser:
     """Parser for various document formats."""
@@ -31,12 +140,13 @@ class DocumentParser:
             '.jpeg',
         }
     
-    def parse(self, file_path: str, doc_id: str) -> Tuple[str, int, List[str]]:
+    def parse(self, file_path: str, doc_id: str) -> Tuple[str, int, List[str], List[str]]:
         """
-        Parse a document and return text, page count, and image paths.
+        Parse a document and return text, page count, image paths and per-page text.
         
         Returns:
-            Tuple of (full_text, page_count, image_paths)
+            Tuple of (full_text, page_count, image_paths, pages), where
+            pages[i] is the text of page i + 1
         """
         path = Path(file_path)
         ext = path.suffix.lower()
@@ -52,89 +162,122 @@ class DocumentParser:
         else:
             raise ValueError(f"Unsupported file type: {ext}")
     
-    def _parse_pdf(self, file_path: str, doc_id: str) -> Tuple[str, int, List[str]]:
+    def _parse_pdf(self, file_path: str, doc_id: str) -> Tuple[str, int, List[str], List[str]]:
         """Parse PDF file."""
-        text_parts = []
-        image_paths = []
-        
+        data = None
         try:
-            # Try pdfplumber first for better text extraction
-            with pdfplumber.open(file_path) as pdf:
-                page_count = len(pdf.pages)
-                
-                for page_num, page in enumerate(pdf.pages, 1):
-                    # Extract text
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_parts.append(f"\n--- Page {page_num} ---\n{page_text}")
+            import fitz  # PyMuPDF
+            
+            # Read the file once; both PyMuPDF and the pdfplumber fallback
+            # parse from memory
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            
+            # PyMuPDF extracts both text and images; large PDFs are split
+            # across a process pool page by page
+            doc = fitz.open(stream=data, filetype='pdf')
+            try:
+                page_count = len(doc)
+                workers = min(settings.pdf_parse_workers, os.cpu_count() or 1)
+                if workers > 1 and page_count >= PARALLEL_PAGE_THRESHOLD:
+                    # Contiguous page ranges so each task opens the PDF once
+                    step = -(-page_count // workers)
+                    starts = range(0, page_count, step)
+                    with ProcessPoolExecutor(
+                        max_workers=workers,
+                        mp_context=multiprocessing.get_context("spawn")
+                    ) as executor:
+                        extracted = [
+                            page
+                            for batch in executor.map(
+                                _extract_pdf_pages,
+                                [file_path] * len(starts),
+                                starts,
+                                [min(start + step, page_count) for start in starts]
+                            )
+                            for page in batch
+                        ]
+                else:
+                    extracted = [_extract_page(doc, i) for i in range(page_count)]
+            finally:
+                doc.close()
+            
+            # OCR all images in one batch straight from memory
+            image_refs = [
+                (page_num, img_idx, image_bytes)
+                for page_num, (_, images) in enumerate(extracted, 1)
+                for img_idx, image_bytes in enumerate(images)
+            ]
+            ocr_texts = _ocr_images([image_bytes for _, _, image_bytes in image_refs])
+            
+            ocr_by_page = defaultdict(list)
+            for (page_num, _, _), ocr_text in zip(image_refs, ocr_texts):
+                if ocr_text.strip():
+                    ocr_by_page[page_num].append(f"\n[Image OCR from page {page_num}]:\n{ocr_text}")
+            
+            # Save images
+            image_dir = Path(settings.raw_docs_dir) / doc_id / "images"
+            image_paths = []
+            for page_num, img_idx, image_bytes in image_refs:
+                try:
+                    image_dir.mkdir(parents=True, exist_ok=True)
+                    image_path = image_dir / f"page_{page_num}_img_{img_idx}.png"
                     
-                    # Extract images from page
-                    images = page.images
-                    if images:
-                        # Use PyMuPDF to extract images
-                        doc = fitz.open(file_path)
-                        page_obj = doc[page_num - 1]
-                        image_list = page_obj.get_images()
-                        
-                        for img_idx, img in enumerate(image_list):
-                            try:
-                                xref = img[0]
-                                base_image = doc.extract_image(xref)
-                                image_bytes = base_image["image"]
-                                
-                                # Save image
-                                image_dir = Path(settings.raw_docs_dir) / doc_id / "images"
-                                image_dir.mkdir(parents=True, exist_ok=True)
-                                image_path = image_dir / f"page_{page_num}_img_{img_idx}.png"
-                                
-                                with open(image_path, "wb") as img_file:
-                                    img_file.write(image_bytes)
-                                
-                                image_paths.append(str(image_path))
-                                
-                                # OCR the image
-                                try:
-                                    ocr_text = pytesseract.image_to_string(Image.open(image_path))
-                                    if ocr_text.strip():
-                                        text_parts.append(f"\n[Image OCR from page {page_num}]:\n{ocr_text}")
-                                except Exception as e:
-                                    logger.warning(f"OCR failed for image {image_path}: {e}")
-                                
-                            except Exception as e:
-                                logger.warning(f"Failed to extract image from PDF page {page_num}: {e}")
-                        
-                        doc.close()
-                
-                full_text = "\n".join(text_parts)
-                return full_text, page_count, image_paths
-                
+                    with open(image_path, "wb") as img_file:
+                        img_file.write(image_bytes)
+                    
+                    image_paths.append(str(image_path))
+                except Exception as e:
+                    logger.warning(f"Failed to save image from PDF page {page_num}: {e}")
+            
+            # Page text followed by the OCR text of that page's images
+            text_parts = []
+            pages = []
+            for page_num, (page_text, _) in enumerate(extracted, 1):
+                ocr_parts = ocr_by_page.get(page_num, [])
+                if page_text:
+                    text_parts.append(f"\n--- Page {page_num} ---\n{page_text}")
+                text_parts.extend(ocr_parts)
+                pages.append("\n".join([page_text, *ocr_parts]))
+            
+            full_text = "\n".join(text_parts)
+            return full_text, page_count, image_paths, pages
+            
         except Exception as e:
-            logger.error(f"Error parsing PDF with pdfplumber: {e}")
-            # Fallback to PyMuPDF
+            logger.error(f"Error parsing PDF with PyMuPDF: {e}")
+            # Fallback to pdfplumber (text only)
             try:
-                doc = fitz.open(file_path)
-                page_count = len(doc)
-                text_parts = []
+                import pdfplumber
                 
-                for page_num in range(page_count):
-                    page = doc[page_num]
-                    page_text = page.get_text()
-                    if page_text:
-                        text_parts.append(f"\n--- Page {page_num + 1} ---\n{page_text}")
+                if data is None:
+                    with open(file_path, 'rb') as f:
+                        data = f.read()
+                with pdfplumber.open(io.BytesIO(data)) as pdf:
+                    page_count = len(pdf.pages)
+                    text_parts = []
+                    pages = []
+                    
+                    for page_num, page in enumerate(pdf.pages, 1):
+                        page_text = page.extract_text() or ""
+                        if page_text:
+                            text_parts.append(f"\n--- Page {page_num} ---\n{page_text}")
+                        pages.append(page_text)
                 
                 full_text = "\n".join(text_parts)
-                doc.close()
-                return full_text, page_count, image_paths
+                return full_text, page_count, [], pages
                 
             except Exception as e2:
-                logger.error(f"Error parsing PDF with PyMuPDF: {e2}")
+                logger.error(f"Error parsing PDF with pdfplumber: {e2}")
                 raise
     
-    def _parse_docx(self, file_path: str, doc_id: str) -> Tuple[str, int, List[str]]:
+    def _parse_docx(self, file_path: str, doc_id: str) -> Tuple[str, int, List[str], List[str]]:
         """Parse DOCX file."""
+        import docx
+        
         try:
             doc = docx.Document(file_path)
             text_parts = []
+            images = []
             image_paths = []
             
             # Extract text from paragraphs
@@ -151,43 +294,48 @@ class DocumentParser:
                 for rel in doc.part.rels.values():
                     if "image" in rel.target_ref:
                         try:
-                            image = rel.target_part.blob
-                            image_path = image_dir / f"image_{len(image_paths)}.png"
-                            
-                            with open(image_path, "wb") as img_file:
-                                img_file.write(image)
-                            
-                            image_paths.append(str(image_path))
-                            
-                            # OCR the image
-                            try:
-                                ocr_text = pytesseract.image_to_string(Image.open(image_path))
-                                if ocr_text.strip():
-                                    text_parts.append(f"\n[Image OCR]:\n{ocr_text}")
-                            except Exception as e:
-                                logger.warning(f"OCR failed for image {image_path}: {e}")
-                                
+                            images.append(rel.target_part.blob)
                         except Exception as e:
                             logger.warning(f"Failed to extract image from DOCX: {e}")
             except Exception as e:
                 logger.warning(f"Error extracting images from DOCX: {e}")
             
+            # OCR the images in one batch straight from memory
+            for ocr_text in _ocr_images(images):
+                if ocr_text.strip():
+                    text_parts.append(f"\n[Image OCR]:\n{ocr_text}")
+            
+            # Save images
+            for image in images:
+                try:
+                    image_path = image_dir / f"image_{len(image_paths)}.png"
+                    
+                    with open(image_path, "wb") as img_file:
+                        img_file.write(image)
+                    
+                    image_paths.append(str(image_path))
+                except Exception as e:
+                    logger.warning(f"Failed to save image from DOCX: {e}")
+            
             full_text = "\n".join(text_parts)
             # Estimate pages (rough: ~500 words per page)
             word_count = len(full_text.split())
             page_count = max(1, word_count // 500)
             
-            return full_text, page_count, image_paths
+            # No real page boundaries in DOCX; treat the text as one page
+            return full_text, page_count, image_paths, [full_text]
             
         except Exception as e:
             logger.error(f"Error parsing DOCX: {e}")
             raise
     
-    def _parse_image(self, file_path: str, doc_id: str) -> Tuple[str, int, List[str]]:
+    def _parse_image(self, file_path: str, doc_id: str) -> Tuple[str, int, List[str], List[str]]:
         """Parse image file with OCR."""
+        from PIL import Image
+        
         try:
             image = Image.open(file_path)
-            text = pytesseract.image_to_string(image)
+            text = _image_to_string(image)
             
             # Save a copy in the doc directory
             image_dir = Path(settings.raw_docs_dir) / doc_id / "images"
@@ -195,19 +343,25 @@ class DocumentParser:
             saved_path = image_dir / Path(file_path).name
             image.save(saved_path)
             
-            return text, 1, [str(saved_path)]
+            return text, 1, [str(saved_path)], [text]
             
         except Exception as e:
             logger.error(f"Error parsing image: {e}")
             raise
 
-    def _parse_html(self, file_path: str, doc_id: str) -> Tuple[str, int, List[str]]:
+    def _parse_html(self, file_path: str, doc_id: str) -> Tuple[str, int, List[str], List[str]]:
         """Parse HTML file."""
+        from bs4 import BeautifulSoup, FeatureNotFound
+        
         try:
             with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
                 html_content = f.read()
 
-            soup = BeautifulSoup(html_content, "html.parser")
+            # libxml2-backed parser when available, pure-Python otherwise
+            try:
+                soup = BeautifulSoup(html_content, "lxml")
+            except FeatureNotFound:
+                soup = BeautifulSoup(html_content, "html.parser")
 
             for element in soup(["script", "style"]):
                 element.decompose()
@@ -216,25 +370,15 @@ class DocumentParser:
             clean_lines = [line.strip() for line in text.splitlines() if line.strip()]
             clean_text = "\n".join(clean_lines)
 
-            return clean_text, 1, []
+            return clean_text, 1, [], [clean_text]
         except Exception as e:
             logger.error(f"Error parsing HTML: {e}")
             raise
     
     def clean_text(self, text: str) -> str:
         """Clean extracted text."""
+        # Remove headers/footers (simple heuristic: very short lines with page numbers)
+        text = _SHORT_NUMERIC_LINE_RE.sub('', text)
         # Remove excessive whitespace
-        lines = text.split('\n')
-        cleaned_lines = []
-        
-        for line in lines:
-            # Remove headers/footers (simple heuristic: very short lines with page numbers)
-            if len(line.strip()) < 3 and any(char.isdigit() for char in line):
-                continue
-            
-            cleaned_line = ' '.join(line.split())
-            if cleaned_line:
-                cleaned_lines.append(cleaned_line)
-        
-        return '\n'.join(cleaned_lines)
-
+        text = _WS_RE.sub(' ', text)
+        return '\n'.join(filter(None, (line.strip() for line in text.split('\n'))))
@@ -1,5 +1,13 @@
 """RAG (Retrieval-Augmented Generation) service."""
+import bisect
+import hashlib
+import itertools
 import logging
+import operator
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import List, Dict, Any, Optional, Tuple
 
 from app.services.vector_store import VectorStore
@@ -9,34 +17,146 @@ from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Default system prompt for pen-test context. A constant, so it is
+# byte-identical across calls and stays a stable prompt-cache prefix.
+_DEFAULT_SYSTEM_PROMPT = """You are an assistant specialized in reviewing system architecture and security documents for penetration testing. You MUST:
+
+- Use only the provided context (between ===CONTEXT START=== and ===CONTEXT END===).
+- If the answer is not in the context, say "Not found in provided docs." and suggest next steps.
+- Output the answer with: "Summary:", "Technologies:", "Focus Areas:", "Use Cases:", "Sources:".
+- Sources must list filename + page + chunk_id for each referenced chunk.
+- Be concise but thorough for penetration testing teams.
+- Focus on security implications and attack surfaces."""
+
+# How long a request waits for the guardrails service to finish initializing
+# before going ahead without it
+GUARDRAILS_INIT_TIMEOUT = 2.0
+
+_guardrails_init_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="guardrails-init")
+
+# Upper bound on chunks retrieved per query, to keep searches fast
+MAX_TOP_K = 10
+
+# Number of formatted context packs kept per RAGService
+CONTEXT_PACK_CACHE_SIZE = 256
+
+# classify_answer_type keywords, in priority order. Matched against whole
+# words of the query (so 'tech' no longer fires on 'architecture').
+_ANSWER_TYPE_KEYWORDS = (
+    ("summary", frozenset({'summary', 'summaries', 'summarize', 'summarise', 'overview'})),
+    ("tech_list", frozenset({'technology', 'technologies', 'tech', 'stack', 'tool', 'tools'})),
+    ("focus", frozenset({'focus', 'area', 'areas', 'priority', 'priorities', 'important'})),
+    ("steps", frozenset({'step', 'steps', 'how', 'process', 'procedure', 'procedures'})),
+    ("finding", frozenset({'vulnerability', 'vulnerabilities', 'exploit', 'exploits', 'attack', 'attacks', 'security'})),
+)
+_WORD_RE = re.compile(r'\w+')
+
+# Common technology patterns, combined into one alternation so
+# extract_technologies scans the text once
+_TECH_PATTERNS = (
+    r'nginx|apache|tomcat|iis',
+    r'aws|azure|gcp|cloud',
+    r'docker|kubernetes|k8s|container',
+    r'mysql|postgresql|mongodb|redis|elasticsearch',
+    r'python|java|node\.?js|go|rust|php|ruby',
+    r'react|vue|angular|django|flask|spring',
+    r'ssh|ftp|http|https|tls|ssl',
+    r'oauth|jwt|saml|ldap|kerberos',
+)
+_TECH_RE = re.compile(r'\b(?:' + '|'.join(_TECH_PATTERNS) + r')\b', re.IGNORECASE)
+
+
+# Fields of a retrieved chunk used in the context, in template order. Search
+# results always carry all of them, so they are fetched in a single call.
+_chunk_fields = operator.itemgetter('filename', 'page', 'chunk_id', 'text')
+
+
+def _format_chunk(chunk: Dict[str, Any]) -> str:
+    """Format one retrieved chunk for the context block."""
+    try:
+        filename, page, chunk_id, text = _chunk_fields(chunk)
+    except KeyError:
+        # Chunks built outside VectorStore.search may lack some fields
+        get = chunk.get
+        filename, page, chunk_id, text = (
+            get('filename', 'unknown'), get('page', 0), get('chunk_id', 'unknown'), get('text', '')
+        )
+    return f"[Source: {filename}, Page {page}, Chunk {chunk_id}]\n{text}"
+
 
 class RAGService:
     """RAG service for retrieval and generation."""
     
+    __slots__ = (
+        'vector_store', 'embedder', 'model_adapter', '_guardrails_service',
+        '_guardrails_future', '_guardrails_waited', '_early_exit', '_context_packs',
+        '_context_packs_lock'
+    )
+    
+    # Vector store, embedder and model adapter shared by every instance, so
+    # services created per request don't reopen them
+    _shared: Dict[str, Any] = {}
+    _shared_lock = threading.Lock()
+    
     def __init__(self):
-        self.vector_store = VectorStore()
-        self.embedder = Embedder()
-        self.model_adapter = get_model_adapter()
+        self.vector_store, self.embedder, self.model_adapter = self._get_shared_components()
         self._guardrails_service = None
+        self._guardrails_future: Optional[Future] = None
+        self._guardrails_waited = False
+        self._early_exit = settings.early_exit_confidence
+        # Sorted chunk_id tuple -> (formatted context, version), in LRU order
+        self._context_packs: "OrderedDict[Tuple[str, ...], Tuple[str, str]]" = OrderedDict()
+        # The shared chat service serves concurrent requests from the threadpool
+        self._context_packs_lock = threading.Lock()
+    
+    @classmethod
+    def _get_shared_components(cls) -> Tuple[VectorStore, Embedder, Any]:
+        """Create the shared components on first use."""
+        with cls._shared_lock:
+            if not cls._shared:
+                cls._shared['vector_store'] = VectorStore()
+                cls._shared['embedder'] = Embedder()
+                cls._shared['model_adapter'] = get_model_adapter()
+        return cls._shared['vector_store'], cls._shared['embedder'], cls._shared['model_adapter']
+    
+    def start_guardrails_init(self):
+        """Start initializing the guardrails service in the background."""
+        if self._guardrails_service is None and self._guardrails_future is None:
+            self._guardrails_future = _guardrails_init_executor.submit(self._create_guardrails_service)
+    
+    def _create_guardrails_service(self):
+        """Build and health-check the guardrails service; False if unavailable."""
+        try:
+            from app.services.guardrails_service import GuardrailsService
+            service = GuardrailsService(
+                model_adapter=self.model_adapter,
+                rag_service=self
+            )
+            # Only use it if service is properly initialized
+            if service and service.health_check():
+                return service
+        except Exception as e:
+            logger.debug(f"Could not initialize guardrails service: {e}")
+        return False  # Mark as unavailable
     
     @property
     def guardrails_service(self):
-        """Lazy initialization of guardrails service."""
+        """
+        Lazy initialization of guardrails service.
+        
+        Initialization runs in the background. The first caller waits up to
+        GUARDRAILS_INIT_TIMEOUT for it; later callers don't wait and simply
+        pick the service up once it is ready.
+        """
         if self._guardrails_service is None:
-            try:
-                from app.services.guardrails_service import GuardrailsService
-                service = GuardrailsService(
-                    model_adapter=self.model_adapter,
-                    rag_service=self
-                )
-                # Only set if service is properly initialized
-                if service and service.health_check():
-                    self._guardrails_service = service
-                else:
-                    self._guardrails_service = False  # Mark as unavailable
-            except Exception as e:
-                logger.debug(f"Could not initialize guardrails service: {e}")
-                self._guardrails_service = False  # Mark as unavailable
+            self.start_guardrails_init()
+            future = self._guardrails_future
+            if future.done() or not self._guardrails_waited:
+                self._guardrails_waited = True
+                try:
+                    self._guardrails_service = future.result(timeout=GUARDRAILS_INIT_TIMEOUT)
+                except FutureTimeoutError:
+                    logger.warning("Guardrails service still initializing; continuing without it for now")
         
         # Return service if it's a valid object, None otherwise
         if self._guardrails_service and self._guardrails_service is not False:
@@ -50,10 +170,8 @@ class RAGService:
         doc_ids: Optional[List[str]] = None
     ) -> List[Dict[str, Any]]:
         """Retrieve relevant chunks for a query with optimizations."""
-        top_k = top_k or settings.top_k
-        
         # Limit top_k to reasonable maximum to prevent slow searches
-        top_k = min(top_k, 10)
+        top_k = min(top_k or settings.top_k, MAX_TOP_K)
         
         # Get query embedding
         query_embedding = self.embedder.get_embedding(query)
@@ -69,13 +187,12 @@ class RAGService:
             doc_ids=doc_ids
         )
         
-        # Early exit if we have high confidence results
-        if results and settings.early_exit_confidence > 0:
-            top_score = results[0].get('score', 0.0) if results else 0.0
-            if top_score >= settings.early_exit_confidence:
-                # Return only top results if confidence is very high
-                logger.debug(f"Early exit: top confidence {top_score:.3f} >= {settings.early_exit_confidence}")
-                return results[:min(3, len(results))]
+        # Early exit if we have high confidence results: return only the top few
+        if results and self._early_exit > 0:
+            top_score = results[0].get('score', 0.0)
+            if top_score >= self._early_exit:
+                logger.debug(f"Early exit: top confidence {top_score:.3f} >= {self._early_exit}")
+                return results[:3]
         
         return results
     
@@ -103,30 +220,24 @@ class RAGService:
             Generated response
         """
         # Build context from retrieved chunks with size limit
-        context_parts = []
-        total_length = 0
         max_length = settings.max_context_tokens * 4  # Rough estimate: 4 chars per token
+        chunk_texts = [_format_chunk(chunk) for chunk in retrieved_chunks]
         
-        for chunk in retrieved_chunks:
-            chunk_text = f"[Source: {chunk.get('filename', 'unknown')}, Page {chunk.get('page', 0)}, "
-            chunk_text += f"Chunk {chunk.get('chunk_id', 'unknown')}]\n{chunk.get('text', '')}"
-            
-            # Limit context size to prevent slow generation
-            if total_length + len(chunk_text) > max_length:
-                logger.debug(f"Context limit reached, truncating at {len(context_parts)} chunks")
-                break
-            
-            context_parts.append(chunk_text)
-            total_length += len(chunk_text)
+        # Limit context size to prevent slow generation: keep the longest
+        # prefix of chunks whose total length fits
+        cut = bisect.bisect_right(list(itertools.accumulate(map(len, chunk_texts))), max_length)
+        if cut < len(chunk_texts):
+            logger.debug(f"Context limit reached, truncating at {cut} chunks")
+        context_parts = list(zip(retrieved_chunks[:cut], chunk_texts[:cut]))
         
-        context = "\n\n".join(context_parts)
+        context = self._get_context_pack(context_parts)
         
         system_prompt = ""
         if use_system_prompt and not general_mode:
             if custom_system_prompt and custom_system_prompt.strip():
                 system_prompt = custom_system_prompt.strip()
             else:
-                system_prompt = self._get_default_system_prompt()
+                system_prompt = _DEFAULT_SYSTEM_PROMPT
         elif custom_system_prompt and custom_system_prompt.strip():
             system_prompt = custom_system_prompt.strip()
         
@@ -165,65 +276,79 @@ class RAGService:
     
     def _get_default_system_prompt(self) -> str:
         """Get default system prompt for pen-test context."""
-        return """You are an assistant specialized in reviewing system architecture and security documents for penetration testing. You MUST:
-
-- Use only the provided context (between ===CONTEXT START=== and ===CONTEXT END===).
-- If the answer is not in the context, say "Not found in provided docs." and suggest next steps.
-- Output the answer with: "Summary:", "Technologies:", "Focus Areas:", "Use Cases:", "Sources:".
-- Sources must list filename + page + chunk_id for each referenced chunk.
-- Be concise but thorough for penetration testing teams.
-- Focus on security implications and attack surfaces."""
+        return _DEFAULT_SYSTEM_PROMPT
+    
+    def _get_context_pack(self, context_parts: List[Tuple[Dict[str, Any], str]]) -> str:
+        """
+        Join the kept chunks into a deterministic, cached context pack.
+        
+        Truncation follows relevance order; the kept chunks are then ordered
+        by (filename, page, chunk_id) so the same chunk set always yields the
+        same context string, and with it a reusable prompt prefix for the
+        model's prompt cache. Packs are cached by their sorted chunk_ids.
+        """
+        chunk_ids = [chunk.get('chunk_id') for chunk, _ in context_parts]
+        key = tuple(sorted(chunk_ids)) if all(chunk_ids) else None
+        
+        if key is not None:
+            with self._context_packs_lock:
+                cached = self._context_packs.get(key)
+                if cached is not None:
+                    self._context_packs.move_to_end(key)
+            if cached is not None:
+                context, version = cached
+                logger.debug(f"Reusing context pack {version}")
+                return context
+        
+        context_parts = sorted(context_parts, key=self._chunk_sort_key)
+        context = "\n\n".join(chunk_text for _, chunk_text in context_parts)
+        
+        version = hashlib.blake2b(context.encode(), digest_size=8).hexdigest()
+        logger.debug(f"Built context pack {version} from {len(context_parts)} chunks")
+        
+        if key is not None:
+            with self._context_packs_lock:
+                self._context_packs[key] = (context, version)
+                if len(self._context_packs) > CONTEXT_PACK_CACHE_SIZE:
+                    self._context_packs.popitem(last=False)
+        
+        return context
+    
+    @staticmethod
+    def _chunk_sort_key(item: Tuple[Dict[str, Any], str]) -> Tuple[str, int, str]:
+        """Deterministic (filename, page, chunk_id) ordering for context chunks."""
+        chunk = item[0]
+        return (
+            str(chunk.get('filename', '')),
+            chunk.get('page') or 0,
+            str(chunk.get('chunk_id', ''))
+        )
     
     def _build_user_prompt(self, query: str, context: str) -> str:
-        """Build user prompt with context."""
-        return f"""User query: {query}
-
-===CONTEXT START===
+        """
+        Build user prompt with context.
+        
+        The context comes first and the query last, so that system prompt +
+        context form a stable prefix across follow-up questions and only the
+        short query varies.
+        """
+        return f"""===CONTEXT START===
 {context}
 ===CONTEXT END===
 
+User query: {query}
+
 Answer concisely and then expand with actionable items for penetration testers."""
     
     def classify_answer_type(self, query: str, answer: str) -> str:
         """Classify the type of answer."""
-        query_lower = query.lower()
-        answer_lower = answer.lower()
-        
-        if any(word in query_lower for word in ['summary', 'summarize', 'overview']):
-            return "summary"
-        elif any(word in query_lower for word in ['technology', 'tech', 'stack', 'tools']):
-            return "tech_list"
-        elif any(word in query_lower for word in ['focus', 'area', 'priority', 'important']):
-            return "focus"
-        elif any(word in query_lower for word in ['step', 'how', 'process', 'procedure']):
-            return "steps"
-        elif any(word in query_lower for word in ['vulnerability', 'exploit', 'attack', 'security']):
-            return "finding"
-        else:
-            return "general"
+        tokens = frozenset(_WORD_RE.findall(query.lower()))
+        for answer_type, words in _ANSWER_TYPE_KEYWORDS:
+            if not tokens.isdisjoint(words):
+                return answer_type
+        return "general"
     
-    def extract_technologies(self, text: str) -> List[str]:
+    @staticmethod
+    def extract_technologies(text: str) -> List[str]:
         """Extract technology names from text (simple regex-based)."""
-        import re
-        
-        # Common technology patterns
-        tech_patterns = [
-            r'\b(nginx|apache|tomcat|iis)\b',
-            r'\b(aws|azure|gcp|cloud)\b',
-            r'\b(docker|kubernetes|k8s|container)\b',
-            r'\b(mysql|postgresql|mongodb|redis|elasticsearch)\b',
-            r'\b(python|java|node\.?js|go|rust|php|ruby)\b',
-            r'\b(react|vue|angular|django|flask|spring)\b',
-            r'\b(ssh|ftp|http|https|tls|ssl)\b',
-            r'\b(oauth|jwt|saml|ldap|kerberos)\b',
-        ]
-        
-        technologies = set()
-        text_lower = text.lower()
-        
-        for pattern in tech_patterns:
-            matches = re.findall(pattern, text_lower, re.IGNORECASE)
-            technologies.update(matches)
-        
-        return sorted(list(technologies))
-
+        return sorted({match.group(0).lower() for match in _TECH_RE.finditer(text)})
@@ -1,16 +1,93 @@
 """Latest Tools discovery agent using GitHub API."""
+import asyncio
+import hashlib
+import itertools
 import logging
+import random
+import time
 import aiohttp
 import json
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
 from datetime import datetime, timedelta
 from pathlib import Path
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 from app.config import settings
 from app.services.model_adapter import OllamaAdapter
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of GitHub searches in flight at once
+GITHUB_SEARCH_CONCURRENCY = 5
+
+# Stop issuing searches until the rate-limit window resets once fewer than
+# this many requests remain (other searches may already be in flight)
+GITHUB_RATE_LIMIT_RESERVE = GITHUB_SEARCH_CONCURRENCY
+
+# At or below this many candidates, tools are star-ranked without the LLM
+LLM_FILTER_MIN_TOOLS = 20
+# Candidates sent to the LLM filter (bounds the prompt size)
+LLM_FILTER_MAX_TOOLS = 30
+
+
+def _json_loads(data: bytes) -> Any:
+    """Decode JSON, using orjson when available."""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Encode indented JSON, using orjson when available."""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode()
+
+
+def _parse_json_array(text: str) -> Optional[List[Any]]:
+    """
+    Return the first balanced JSON array in `text` that parses, or None.
+    
+    A single bracket-matching pass per candidate '[' (skipping brackets
+    inside strings), so surrounding prose with stray brackets neither
+    breaks extraction nor causes regex backtracking.
+    """
+    start = text.find('[')
+    while start != -1:
+        depth = 0
+        in_string = False
+        escaped = False
+        for i in range(start, len(text)):
+            ch = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == '[':
+                depth += 1
+            elif ch == ']':
+                depth -= 1
+                if depth == 0:
+                    try:
+                        parsed = json.loads(text[start:i + 1])
+                    except ValueError:
+                        break
+                    if isinstance(parsed, list):
+                        return parsed
+                    break
+        start = text.find('[', start + 1)
+    return None
+
 
 class ToolsAgent:
     """Agent for discovering latest penetration testing tools from GitHub."""
@@ -23,50 +100,155 @@ class ToolsAgent:
         self.cache_file = Path(settings.data_dir) / "tools_cache.json"
         self.cache_ttl = timedelta(hours=24)
         self.github_api_url = "https://api.github.com"
+        
+        # State per search ("query|per_page" key): the last ETag GitHub
+        # returned, the tools parsed from that response, and when it was last
+        # fetched or revalidated. Loaded from the cache file on first refresh.
+        self._etags: Optional[Dict[str, str]] = None
+        self._per_query: Optional[Dict[str, List[Dict]]] = None
+        self._per_query_ts: Dict[str, float] = {}
+        
+        # Long-lived HTTP session, so keep-alive connections (and their TLS
+        # handshakes) are reused across refreshes. Created on first use.
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Authenticated searches get a much larger rate-limit budget
+        self.github_token = settings.github_token
+        # Epoch time before which searches are skipped (rate limit nearly spent)
+        self._rate_limited_until: float = 0.0
+        
+        # Parsed cache file and the mtime it was read at; the file is only
+        # re-parsed when it changes on disk. Treat as read-only.
+        self._mem_cache: Optional[Dict] = None
+        self._mem_mtime_ns: int = 0
+    
+    def _read_cache_file(self) -> Dict:
+        """Read the raw cache file, regardless of age (blocking)."""
+        try:
+            mtime_ns = self.cache_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if self._mem_cache is not None and mtime_ns == self._mem_mtime_ns:
+            return self._mem_cache
+        
+        cache_data = _json_loads(self.cache_file.read_bytes())
+        self._mem_cache = cache_data
+        self._mem_mtime_ns = mtime_ns
+        return cache_data
     
-    def _load_cache(self) -> Optional[Dict]:
+    def _write_cache_file(self, cache_data: Dict):
+        """Write the cache file and keep the in-memory copy in step (blocking)."""
+        self.cache_file.write_bytes(_json_dumps(cache_data))
+        self._mem_cache = cache_data
+        self._mem_mtime_ns = self.cache_file.stat().st_mtime_ns
+    
+    async def _load_cache(self) -> Optional[Dict]:
         """Load cached tools (supports legacy flat list and per-category cache)."""
         if not self.cache_file.exists():
             return None
         
         try:
-            with open(self.cache_file, 'r') as f:
-                cache_data = json.load(f)
-            cache_time = datetime.fromisoformat(cache_data.get('timestamp', ''))
-            if datetime.now() - cache_time < self.cache_ttl:
+            cache_data = await asyncio.to_thread(self._read_cache_file)
+            # Prefer the epoch timestamp; older caches only have the ISO string
+            cache_time = cache_data.get('timestamp_epoch')
+            if cache_time is None:
+                cache_time = datetime.fromisoformat(cache_data.get('timestamp', '')).timestamp()
+            if time.time() - cache_time < self.cache_ttl.total_seconds():
                 return cache_data
         except Exception as e:
             logger.warning(f"Error loading tools cache: {e}")
         return None
     
-    def _save_cache(self, tools: List[Dict], category: Optional[str] = None):
-        """Save tools to cache, per category, while keeping legacy flat list for compatibility."""
+    async def _save_cache(
+        self,
+        tools: List[Dict],
+        category: Optional[str] = None,
+        fingerprint: Optional[str] = None
+    ):
+        """
+        Save tools to cache, per category, while keeping legacy flat list for compatibility.
+        
+        `fingerprint` identifies the unfiltered tool set the category's
+        result was filtered from.
+        """
         try:
-            existing = {}
-            if self.cache_file.exists():
-                try:
-                    with open(self.cache_file, 'r') as f:
-                        existing = json.load(f)
-                except Exception:
-                    existing = {}
+            try:
+                existing = await asyncio.to_thread(self._read_cache_file)
+            except Exception:
+                existing = {}
 
-            by_category = existing.get('by_category', {})
+            by_category = dict(existing.get('by_category', {}))
             key = category or 'all'
             by_category[key] = tools
+            filter_inputs = dict(existing.get('filter_inputs', {}))
+            if fingerprint:
+                filter_inputs[key] = fingerprint
 
+            now = datetime.now()
+            # Shallow copies taken on the event loop: other requests keep
+            # updating the live dicts while the file is written in a thread
             cache_data = {
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': now.isoformat(),
+                'timestamp_epoch': now.timestamp(),
                 'tools': tools,          # legacy flat list (all)
-                'by_category': by_category
+                'by_category': by_category,
+                'etags': dict(self._etags) if self._etags is not None else existing.get('etags', {}),
+                'per_query': dict(self._per_query) if self._per_query is not None else existing.get('per_query', {}),
+                'per_query_ts': dict(self._per_query_ts) if self._etags is not None else existing.get('per_query_ts', {}),
+                'filter_inputs': filter_inputs
             }
-            with open(self.cache_file, 'w') as f:
-                json.dump(cache_data, f, indent=2)
+            await asyncio.to_thread(self._write_cache_file, cache_data)
         except Exception as e:
             logger.error(f"Error saving tools cache: {e}")
     
-    async def _search_github(self, session: aiohttp.ClientSession, query: str, limit: int = 10) -> List[Dict]:
-        """Search GitHub repositories."""
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared GitHub session, creating it if needed."""
+        if self._session is None or self._session.closed:
+            headers = {
+                'Accept': 'application/vnd.github+json',
+                'User-Agent': 'SecureRAG'
+            }
+            if self.github_token:
+                headers['Authorization'] = f"Bearer {self.github_token}"
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=600, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30),
+                headers=headers
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the shared HTTP session."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    @staticmethod
+    def _query_key(query: str, limit: int) -> str:
+        """Key for per-search state."""
+        return f"{query}|{limit}"
+    
+    async def _search_github(
+        self,
+        session: aiohttp.ClientSession,
+        query: str,
+        limit: Optional[int] = None,
+        sem: Optional[asyncio.Semaphore] = None
+    ) -> List[Dict]:
+        """Search GitHub repositories, holding `sem` (if given) for the request."""
+        if sem is not None:
+            # Small jitter so concurrent searches don't hit the API in lockstep
+            await asyncio.sleep(random.uniform(0, 0.1))
+            async with sem:
+                return await self._search_github(session, query, limit)
+        
+        limit = limit or settings.tools_search_per_page
         tools = []
+        
+        if time.time() < self._rate_limited_until:
+            logger.debug(f"Skipping GitHub search until rate limit resets: {query}")
+            return tools
+        
         try:
             url = f"{self.github_api_url}/search/repositories"
             params = {
@@ -76,11 +258,23 @@ class ToolsAgent:
                 'per_page': limit
             }
             
-            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    for repo in data.get('items', [])[:limit]:
-                        tools.append({
+            # Revalidate with the stored ETag; a 304 is cheap and doesn't count
+            # against the rate limit
+            etag_key = self._query_key(query, limit)
+            headers = {}
+            if self._etags and etag_key in self._etags and etag_key in self._per_query:
+                headers['If-None-Match'] = self._etags[etag_key]
+            
+            async with session.get(url, params=params, headers=headers) as response:
+                self._check_rate_limit(response)
+                if response.status == 304:
+                    logger.debug(f"GitHub search not modified: {query}")
+                    self._per_query_ts[etag_key] = time.time()
+                    return list(self._per_query[etag_key])
+                elif response.status == 200:
+                    items = _json_loads(await response.read()).get('items', [])
+                    tools = [
+                        {
                             'name': repo.get('name', ''),
                             'full_name': repo.get('full_name', ''),
                             'description': repo.get('description') or '',
@@ -89,26 +283,65 @@ class ToolsAgent:
                             'language': repo.get('language') or None,
                             'updated_at': repo.get('updated_at', ''),
                             'topics': repo.get('topics', [])
-                        })
-                elif response.status == 403:
+                        }
+                        for repo in items[:limit]
+                    ]
+                    if self._etags is not None:
+                        etag = response.headers.get('ETag')
+                        if etag:
+                            self._etags[etag_key] = etag
+                        self._per_query[etag_key] = tools
+                        self._per_query_ts[etag_key] = time.time()
+                elif response.status in (403, 429):
                     reset = response.headers.get("X-RateLimit-Reset")
                     reset_msg = f" Rate limit resets at {reset}." if reset else ""
                     logger.warning(f"GitHub API rate limit reached.{reset_msg} Using cached data if available.")
+                    if reset and reset.isdigit():
+                        self._rate_limited_until = max(self._rate_limited_until, float(reset))
         except Exception as e:
             logger.error(f"Error searching GitHub: {e}")
         
         return tools
     
+    def _check_rate_limit(self, response: aiohttp.ClientResponse):
+        """Back off before the rate limit is exhausted rather than after a 403."""
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None or not (remaining.isdigit() and reset.isdigit()):
+            return
+        if int(remaining) < GITHUB_RATE_LIMIT_RESERVE:
+            self._rate_limited_until = max(self._rate_limited_until, float(reset))
+            logger.info(f"GitHub rate limit nearly spent ({remaining} left); pausing searches until {reset}")
+    
     async def _filter_tools(self, tools: List[Dict]) -> List[Dict]:
         """Filter and rank tools using LLM agent."""
         if not tools:
             return []
         
+        # Fallback (and fast path): tools sorted by stars
+        by_stars = sorted(tools, key=lambda x: x.get('stars', 0), reverse=True)[:20]
+        
+        # With few candidates the LLM call costs far more than it adds
+        if settings.tools_skip_llm_filter or len(tools) <= LLM_FILTER_MIN_TOOLS:
+            return by_stars
+        
+        # Send only what the model needs to judge relevance, compactly encoded;
+        # the full records are looked up again by full_name afterwards
+        compact = [
+            {
+                'full_name': t['full_name'],
+                'desc': (t.get('description') or '')[:200],
+                'stars': t.get('stars', 0),
+                'topics': (t.get('topics') or [])[:5]
+            }
+            for t in tools[:LLM_FILTER_MAX_TOOLS]
+        ]
+        
         filter_prompt = f"""Analyze the following GitHub repositories and identify which are relevant penetration testing tools.
-Return a JSON array with the most relevant tools, each with: name, full_name, description, url, stars, language, updated_at, topics, relevance_score.
+Return a JSON array with the most relevant tools, each as {{"full_name": ..., "relevance_score": ...}}.
 
 Repositories to analyze:
-{json.dumps(tools[:30], indent=2)}  # Limit to 30 for prompt size
+{json.dumps(compact, separators=(',', ':'))}
 
 Focus on tools for:
 - Web application security testing
@@ -122,29 +355,35 @@ Focus on tools for:
         try:
             response = self.agent_model.generate_text(
                 prompt=filter_prompt,
-                max_tokens=3000,
+                max_tokens=1500,
                 temperature=0.3
             )
             
             # Try to extract JSON from response
-            import re
-            json_match = re.search(r'\[.*\]', response, re.DOTALL)
-            if json_match:
-                filtered = json.loads(json_match.group())
-                # Sort by relevance_score if available, else by stars
-                filtered.sort(key=lambda x: x.get('relevance_score', x.get('stars', 0)), reverse=True)
-                return filtered[:20]  # Return top 20
+            items = _parse_json_array(response)
+            if items is not None:
+                by_name = {t['full_name']: t for t in tools}
+                filtered = []
+                for item in items:
+                    if isinstance(item, dict) and item.get('full_name') in by_name:
+                        tool = dict(by_name[item['full_name']])
+                        if item.get('relevance_score') is not None:
+                            tool['relevance_score'] = item['relevance_score']
+                        filtered.append(tool)
+                if filtered:
+                    # Sort by relevance_score if available, else by stars
+                    filtered.sort(key=lambda x: x.get('relevance_score', x.get('stars', 0)), reverse=True)
+                    return filtered[:20]  # Return top 20
         except Exception as e:
             logger.warning(f"Error filtering tools with LLM, using unfiltered star-ranked list: {e}")
         
-        # Fallback: return tools sorted by stars
-        return sorted(tools, key=lambda x: x.get('stars', 0), reverse=True)[:20]
+        return by_stars
     
     async def get_latest_tools(self, category: Optional[str] = None) -> List[Dict]:
         """Get latest penetration testing tools from GitHub, optionally filtered by category."""
         # Check cache first (per category if available)
         cache_key = category or 'all'
-        cached_data = self._load_cache()
+        cached_data = await self._load_cache()
         cached_tools = None
         if cached_data:
             cached_by_cat = cached_data.get('by_category', {})
@@ -234,32 +473,69 @@ Focus on tools for:
                 "offensive security"
             ]
         
-        all_tools = []
+        # The category result has expired, but individual searches and the
+        # previous filtered result may still be usable
+        try:
+            cache_file_data = await asyncio.to_thread(self._read_cache_file)
+        except Exception:
+            cache_file_data = {}
+        if self._etags is None:
+            self._etags = dict(cache_file_data.get('etags', {}))
+            self._per_query = dict(cache_file_data.get('per_query', {}))
+            self._per_query_ts = dict(cache_file_data.get('per_query_ts', {}))
+        previous_tools = cache_file_data.get('by_category', {}).get(cache_key)
+        
+        # Only re-run searches whose own results are older than the TTL
+        now = time.time()
+        ttl = self.cache_ttl.total_seconds()
+        query_keys = [self._query_key(query, settings.tools_search_per_page) for query in search_queries]
+        stale_queries = [
+            query for query, key in zip(search_queries, query_keys)
+            if key not in self._per_query or now - self._per_query_ts.get(key, 0) >= ttl
+        ]
+        
         rate_limited = False
-        async with aiohttp.ClientSession() as session:
-            for query in search_queries:
-                tools = await self._search_github(session, query, limit=10)
-                if not tools:
-                    rate_limited = True if rate_limited is False else rate_limited
-                all_tools.extend(tools)
+        if stale_queries:
+            # Run the searches concurrently, bounded to stay under GitHub's limits
+            sem = asyncio.Semaphore(GITHUB_SEARCH_CONCURRENCY)
+            session = self._get_session()
+            results = await asyncio.gather(
+                *(self._search_github(session, query, sem=sem) for query in stale_queries),
+                return_exceptions=True
+            )
+            rate_limited = any(not (isinstance(tools, list) and tools) for tools in results)
+        
+        # Successful searches stored their results in _per_query; failed ones
+        # fall back to their last known results. Interleave them round-robin
+        # so the LLM filter's candidate cap takes the top hits of every query
+        # rather than only the first query's
+        all_tools = [
+            tool
+            for round_tools in itertools.zip_longest(*(self._per_query.get(key, []) for key in query_keys))
+            for tool in round_tools
+            if tool is not None
+        ]
         
-        # Remove duplicates by full_name
-        seen = set()
-        unique_tools = []
-        for tool in all_tools:
-            if tool['full_name'] not in seen:
-                seen.add(tool['full_name'])
-                unique_tools.append(tool)
+        # Remove duplicates by full_name (keeps first-seen order)
+        unique_tools = list({tool['full_name']: tool for tool in all_tools if tool.get('full_name')}.values())
         
-        if not unique_tools and rate_limited and cached_tools:
+        if not unique_tools and rate_limited and previous_tools:
             logger.warning("GitHub rate limit hit; serving cached tools.")
-            return cached_tools
-
-        # Filter and rank using LLM
-        filtered_tools = await self._filter_tools(unique_tools)
+            return previous_tools
+        
+        # Filter and rank using LLM, unless the candidates are the same ones
+        # the previous result was filtered from
+        fingerprint = hashlib.sha1(
+            "\n".join(sorted(tool['full_name'] for tool in unique_tools)).encode()
+        ).hexdigest()
+        if previous_tools and cache_file_data.get('filter_inputs', {}).get(cache_key) == fingerprint:
+            logger.debug(f"Tool candidates unchanged for {cache_key}; reusing filtered result")
+            filtered_tools = previous_tools
+        else:
+            filtered_tools = await self._filter_tools(unique_tools)
         
         # Save to cache (per category)
-        self._save_cache(filtered_tools, category)
+        await self._save_cache(filtered_tools, category, fingerprint)
         
         return filtered_tools
 
@@ -274,3 +550,9 @@ def get_tools_agent() -> ToolsAgent:
         _tools_agent = ToolsAgent()
     return _tools_agent
 
+
+async def close_tools_agent():
+    """Release the tools agent's HTTP resources (application shutdown)."""
+    if _tools_agent is not None:
+        await _tools_agent.close()
+
@@ -1,7 +1,12 @@
 """Vector store adapter for Chroma/FAISS."""
 import os
+import json
 import logging
-from typing import List, Dict, Any, Optional
+import operator
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple, Union
 from pathlib import Path
 
 from app.config import settings
@@ -26,6 +31,518 @@ except ImportError:
     HAS_FAISS = False
     logger.warning("FAISS not available, install with: pip install faiss-cpu")
 
+# numba is optional; it compiles the FAISS hit-selection loop
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# orjson is optional; it speeds up the FAISS metadata log
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# Required chunk fields, fetched together when building store records
+_chunk_fields = operator.itemgetter('chunk_id', 'text', 'doc_id', 'page', 'chunk_index')
+
+
+def _json_loads(data: bytes) -> Any:
+    """Decode JSON, using orjson when available."""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_line(obj: Any) -> bytes:
+    """Encode one JSONL line, using orjson when available."""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(obj).encode() + b'\n'
+
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _select_hits(indices, alive, top_k):
+        """
+        Positions of the first top_k live hits in each row of a FAISS
+        result, padded with -1.
+        """
+        nq, k = indices.shape
+        selected = np.full((nq, top_k), -1, dtype=np.int64)
+        for q in range(nq):
+            n = 0
+            for j in range(k):
+                idx = indices[q, j]
+                if idx >= 0 and alive[idx]:
+                    selected[q, n] = j
+                    n += 1
+                    if n == top_k:
+                        break
+        return selected
+else:
+    def _select_hits(indices, alive, top_k):
+        """
+        Positions of the first top_k live hits in each row of a FAISS
+        result, padded with -1.
+        """
+        valid = indices >= 0
+        valid[valid] = alive[indices[valid]]
+        valid &= np.cumsum(valid, axis=1) <= top_k
+        selected = np.full((len(indices), top_k), -1, dtype=np.int64)
+        for q, row in enumerate(valid):
+            positions = np.flatnonzero(row)
+            selected[q, :len(positions)] = positions
+        return selected
+
+
+def _exact_search(index, query_array: "np.ndarray", rows: "np.ndarray", k: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Score the given rows against the queries by brute force; returns
+    (similarities, ids) shaped like index.search's result.
+    """
+    vectors = index.reconstruct_batch(rows)
+    similarities = query_array @ vectors.T
+    if k < len(rows):
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(len(rows)), similarities.shape)
+    top_similarities = np.take_along_axis(similarities, top, axis=1)
+    order = np.argsort(-top_similarities, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return np.take_along_axis(top_similarities, order, axis=1), rows[top]
+
+
+def _new_faiss_index(dimension: int):
+    """
+    Create an empty FAISS index: HNSW graph over inner product on
+    L2-normalized vectors (cosine similarity, matching the Chroma
+    collection), so searches visit ~log N vectors instead of all N.
+    
+    Vectors are stored as fp16 unless settings.faiss_hnsw_storage is
+    "flat", halving the memory each distance computation streams. The
+    graph is wrapped in an IndexIDMap2 so vectors keep their ids (metadata
+    rows) when the index is rebuilt without deleted vectors.
+    """
+    if settings.faiss_hnsw_storage.lower() == "fp16":
+        hnsw = faiss.IndexHNSWSQ(
+            dimension, faiss.ScalarQuantizer.QT_fp16, settings.faiss_hnsw_m, faiss.METRIC_INNER_PRODUCT
+        )
+    else:
+        hnsw = faiss.IndexHNSWFlat(dimension, settings.faiss_hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    hnsw.hnsw.efConstruction = settings.faiss_hnsw_ef_construction
+    return faiss.IndexIDMap2(hnsw)
+
+
+def _index_vectors(index) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Return all (vectors, ids) stored in a FAISS index."""
+    if isinstance(index, faiss.IndexIDMap2):
+        inner = faiss.downcast_index(index.index)
+        return inner.reconstruct_n(0, inner.ntotal), faiss.vector_to_array(index.id_map)
+    return index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype=np.int64)
+
+
+class _ReadWriteLock:
+    """
+    Lock shared by readers and held exclusively by writers. A waiting
+    writer blocks new readers so a steady stream of searches cannot starve
+    it. Not reentrant.
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+    
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class _MetaColumns:
+    """
+    FAISS chunk metadata as parallel columns indexed by FAISS id.
+    
+    FAISS ids are the row numbers, so a hit's metadata is a list
+    index away. Rows of deleted chunks keep doc_id None. rows_by_doc maps
+    each document to its live rows, for filtered search and deletes.
+    Filenames are interned: rows hold an index into filename_table, so a
+    document's chunks share one string. The alive mask mirrors doc_id is
+    not None as a NumPy array for compiled hit selection.
+    """
+    
+    __slots__ = (
+        'chunk_ids', 'doc_ids', 'filename_ids', 'texts', 'pages', 'chunk_indexes',
+        'rows_by_doc', 'filename_table', '_filename_index', '_alive'
+    )
+    
+    def __init__(self, size: int = 0):
+        self.chunk_ids: List[Optional[str]] = [None] * size
+        self.doc_ids: List[Optional[str]] = [None] * size
+        self.filename_ids = array('i', bytes(4 * size))
+        self.texts: List[str] = [''] * size
+        self.pages = array('i', bytes(4 * size))
+        self.chunk_indexes = array('i', bytes(4 * size))
+        self.rows_by_doc: Dict[str, List[int]] = {}
+        self.filename_table: List[str] = ['']
+        self._filename_index: Dict[str, int] = {'': 0}
+        # Grown geometrically; only the first len(self) entries are used
+        self._alive = np.zeros(max(size, 1024), dtype=bool)
+    
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+    
+    @property
+    def alive(self) -> "np.ndarray":
+        return self._alive[:len(self.doc_ids)]
+    
+    def append(self, chunk_id: str, doc_id: str, filename: str, page: int, chunk_index: int, text: str):
+        self.chunk_ids.append(chunk_id)
+        self.doc_ids.append(doc_id)
+        self.filename_ids.append(self._intern_filename(filename))
+        self.texts.append(text)
+        self.pages.append(page)
+        self.chunk_indexes.append(chunk_index)
+        row = len(self.doc_ids) - 1
+        self.rows_by_doc.setdefault(doc_id, []).append(row)
+        if row >= len(self._alive):
+            self._alive = np.concatenate([self._alive, np.zeros(len(self._alive), dtype=bool)])
+        self._alive[row] = True
+    
+    def set_record(self, row: int, record: Dict[str, Any]):
+        """Fill a row from a serialized metadata record."""
+        self.chunk_ids[row] = record.get('chunk_id')
+        self.doc_ids[row] = record.get('doc_id')
+        self.filename_ids[row] = self._intern_filename(record.get('filename') or '')
+        self.texts[row] = record.get('text', '')
+        self.pages[row] = record.get('page') or 0
+        self.chunk_indexes[row] = record.get('chunk_index') or 0
+        if self.doc_ids[row] is not None:
+            self.rows_by_doc.setdefault(self.doc_ids[row], []).append(row)
+            self._alive[row] = True
+    
+    def record(self, row: int) -> Dict[str, Any]:
+        """Serialized metadata record for a row."""
+        return {
+            'id': row,
+            'chunk_id': self.chunk_ids[row],
+            'doc_id': self.doc_ids[row],
+            'page': self.pages[row],
+            'chunk_index': self.chunk_indexes[row],
+            'text': self.texts[row],
+            'filename': self.filename(row),
+        }
+    
+    def filename(self, row: int) -> str:
+        return self.filename_table[self.filename_ids[row]]
+    
+    def _intern_filename(self, filename: str) -> int:
+        filename_id = self._filename_index.get(filename)
+        if filename_id is None:
+            filename_id = self._filename_index[filename] = len(self.filename_table)
+            self.filename_table.append(filename)
+        return filename_id
+    
+    def _blank(self, row: int):
+        self._alive[row] = False
+        self.doc_ids[row] = None
+        self.chunk_ids[row] = None
+        self.texts[row] = ''
+    
+    def clear(self, row: int):
+        """Mark a row deleted and drop its text."""
+        doc_id = self.doc_ids[row]
+        doc_rows = self.rows_by_doc.get(doc_id)
+        if doc_rows is not None:
+            doc_rows.remove(row)
+            if not doc_rows:
+                del self.rows_by_doc[doc_id]
+        self._blank(row)
+    
+    def clear_doc(self, doc_id: str) -> List[int]:
+        """Mark all rows of a document deleted; returns them."""
+        rows = self.rows_by_doc.pop(doc_id, [])
+        for row in rows:
+            self._blank(row)
+        return rows
+    
+    def live_rows(self) -> List[int]:
+        return [row for row, doc_id in enumerate(self.doc_ids) if doc_id is not None]
+
+
+class _FaissStore:
+    """
+    FAISS index and chunk metadata for one store directory.
+    
+    Shared by every VectorStore in the process (see _get_faiss_store), so
+    per-request VectorStore objects neither reload the index nor write
+    conflicting copies of it. Metadata is an append-only JSONL log (one
+    record per chunk, plus deletion records), so an add writes only its new
+    chunks; the index itself is snapshotted every
+    settings.faiss_snapshot_every adds and on flush.
+    """
+    
+    def __init__(self, db_path: Path):
+        # Searches share the lock; adds, deletes and snapshots take it alone
+        self.lock = _ReadWriteLock()
+        self.index_path = db_path / "faiss.index"
+        self.metadata_path = db_path / "metadata.jsonl"
+        self.index = None
+        self.meta = _MetaColumns()
+        self._unsaved_adds = 0
+        self._compaction: Optional[threading.Thread] = None
+        self._load(db_path / "metadata.json")
+    
+    def _load(self, legacy_metadata_path: Path):
+        """Load the index snapshot and replay the metadata log."""
+        if self.index_path.exists():
+            self.index = faiss.read_index(str(self.index_path))
+            self._ensure_index_layout()
+        
+        # Rows without a vector in the snapshot (appended after it, or
+        # compacted away) are dropped
+        if self.index is not None and self.index.ntotal:
+            index_ids = faiss.vector_to_array(self.index.id_map)
+            size = int(index_ids.max()) + 1
+        else:
+            index_ids = np.empty(0, dtype=np.int64)
+            size = 0
+        in_index = np.zeros(size, dtype=bool)
+        in_index[index_ids] = True
+        self.meta = _MetaColumns(size)
+        orphaned = 0
+        
+        if self.metadata_path.exists():
+            with open(self.metadata_path, 'rb') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = _json_loads(line)
+                    if 'deleted' in record:
+                        for row in record['deleted']:
+                            row = int(row)
+                            if row < size and in_index[row]:
+                                self.meta.clear(row)
+                    elif int(record['id']) < size and in_index[int(record['id'])]:
+                        self.meta.set_record(int(record['id']), record)
+                    else:
+                        orphaned += 1
+        elif legacy_metadata_path.exists():
+            # metadata.json from older versions: convert to the log format
+            with open(legacy_metadata_path, 'rb') as f:
+                for key, record in _json_loads(f.read()).items():
+                    if int(key) < size and in_index[int(key)]:
+                        self.meta.set_record(int(key), record)
+            self._rewrite_metadata()
+            legacy_metadata_path.unlink()
+        
+        if orphaned:
+            logger.info(f"Dropping {orphaned} FAISS metadata records without vectors in the index snapshot")
+            self._rewrite_metadata()
+    
+    def _ensure_index_layout(self):
+        """
+        Rebuild an index written by older versions (flat L2 over raw
+        vectors, flat inner product, or HNSW without an id map), or with a
+        different vector storage setting, into the current layout.
+        """
+        if isinstance(self.index, faiss.IndexIDMap2) and self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            inner = faiss.downcast_index(self.index.index)
+            storage = "fp16" if isinstance(inner, faiss.IndexHNSWSQ) else "flat"
+            if hasattr(inner, 'hnsw') and storage == settings.faiss_hnsw_storage.lower():
+                return
+        
+        logger.info(
+            f"Rebuilding FAISS index ({self.index.ntotal} vectors) as cosine HNSW "
+            f"({settings.faiss_hnsw_storage} storage)"
+        )
+        vectors, ids = _index_vectors(self.index)
+        if self.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+            faiss.normalize_L2(vectors)
+        index = _new_faiss_index(self.index.d)
+        index.add_with_ids(vectors, ids)
+        self.index = index
+        self._write_index()
+    
+    def _write_index(self):
+        """Write the index snapshot atomically, so a crash mid-write leaves the previous one."""
+        tmp_path = self.index_path.with_suffix('.tmp')
+        faiss.write_index(self.index, str(tmp_path))
+        os.replace(tmp_path, self.index_path)
+    
+    def _rewrite_metadata(self):
+        """Rewrite the metadata log from memory (migration and repair)."""
+        tmp_path = self.metadata_path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            for row in self.meta.live_rows():
+                f.write(_json_line(self.meta.record(row)))
+        os.replace(tmp_path, self.metadata_path)
+    
+    def append_metadata(self, records: Iterable[Dict[str, Any]]):
+        """Append records to the metadata log."""
+        with open(self.metadata_path, 'ab') as f:
+            f.writelines(_json_line(record) for record in records)
+    
+    def note_add(self):
+        """Count an add, snapshotting the index when one is due."""
+        self._unsaved_adds += 1
+        if self._unsaved_adds >= settings.faiss_snapshot_every:
+            self.save_index()
+    
+    def compact_if_needed(self):
+        """
+        Start a background rebuild of the index without deleted vectors
+        once they make up settings.faiss_compact_deleted_ratio of it. HNSW
+        graphs cannot remove vectors in place, so deletes only hide them
+        until then. Call with the write lock held.
+        """
+        if self.index is None or (self._compaction is not None and self._compaction.is_alive()):
+            return
+        live = sum(map(len, self.meta.rows_by_doc.values()))
+        dead = self.index.ntotal - live
+        if dead <= 0 or dead < settings.faiss_compact_deleted_ratio * self.index.ntotal:
+            return
+        
+        logger.info(f"Compacting FAISS index in the background: dropping {dead} deleted vectors")
+        self._compaction = threading.Thread(target=self._compact, name="faiss-compaction", daemon=True)
+        self._compaction.start()
+    
+    def _compact(self):
+        """Build the compacted index outside the lock and swap it in under it."""
+        try:
+            with self.lock.read():
+                source = self.index
+                vectors, ids = _index_vectors(source)
+                keep = self._live_mask(ids)
+            
+            # Deletes that land during a rebuild trigger one more rebuild;
+            # after that they stay hidden by the alive mask until the next one
+            for retries_left in (1, 0):
+                index = _new_faiss_index(source.d)
+                index.add_with_ids(vectors[keep], ids[keep])
+                
+                with self.lock.write():
+                    if self.index is not source:
+                        return
+                    live = self._live_mask(ids)
+                    if retries_left and (keep & ~live).any():
+                        keep = live
+                        continue
+                    # Carry over live vectors added during the rebuild
+                    added = np.setdiff1d(faiss.vector_to_array(source.id_map), ids)
+                    added = added[self._live_mask(added)]
+                    if len(added):
+                        index.add_with_ids(source.reconstruct_batch(added), added)
+                    self.index = index
+                    self._write_index()
+                    self._unsaved_adds = 0
+                    self._rewrite_metadata()
+                    break
+            logger.info(f"Compacted FAISS index to {index.ntotal} vectors")
+        except Exception as e:
+            logger.error(f"FAISS index compaction failed: {e}")
+    
+    def _live_mask(self, ids: "np.ndarray") -> "np.ndarray":
+        doc_ids = self.meta.doc_ids
+        return np.fromiter((doc_ids[row] is not None for row in ids.tolist()), dtype=bool, count=len(ids))
+    
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """Wait for a background compaction, if one is running."""
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join(timeout)
+    
+    def save_index(self):
+        """Write the index snapshot if there are unsaved adds."""
+        if self.index is not None and self._unsaved_adds:
+            self._write_index()
+        self._unsaved_adds = 0
+
+
+_faiss_stores: Dict[Path, _FaissStore] = {}
+_faiss_stores_lock = threading.Lock()
+
+
+def _log_faiss_build():
+    """Log the SIMD level FAISS was loaded with, warning if it underuses the CPU."""
+    try:
+        compile_options = faiss.get_compile_options().split()
+        cpu_features = faiss.supported_instruction_sets()
+    except Exception as e:
+        logger.debug(f"Could not read FAISS build information: {e}")
+        return
+    
+    logger.info(f"FAISS compile options: {' '.join(compile_options)}")
+    if 'AVX512F' in cpu_features and 'AVX512' not in compile_options:
+        logger.warning(
+            "CPU supports AVX-512 but the loaded FAISS library was not built for it; "
+            "distance computations run at AVX2 speed or lower"
+        )
+
+
+def _get_faiss_store(db_path: Path) -> _FaissStore:
+    """Return the process-wide FAISS store for a directory, loading it once."""
+    key = db_path.resolve()
+    with _faiss_stores_lock:
+        store = _faiss_stores.get(key)
+        if store is None:
+            if not _faiss_stores:
+                _log_faiss_build()
+                # HNSW inserts and searches run on OpenMP threads
+                faiss.omp_set_num_threads(settings.faiss_omp_threads or os.cpu_count() or 1)
+            store = _faiss_stores[key] = _FaissStore(db_path)
+        return store
+
+
+# Document info per store, shared by all VectorStore instances (see
+# get_all_document_ids). Writes bump the store's version so a scan that
+# overlapped a write is not cached.
+_doc_info_cache: Dict[Tuple[str, str], Dict[str, Dict[str, Any]]] = {}
+_doc_info_versions: Dict[Tuple[str, str], int] = {}
+_doc_info_lock = threading.Lock()
+
+
+def flush_vector_stores():
+    """Snapshot every loaded FAISS index (application shutdown)."""
+    with _faiss_stores_lock:
+        stores = list(_faiss_stores.values())
+    for store in stores:
+        try:
+            # A compaction cut off by exit would lose its index snapshot
+            store.wait_for_compaction(settings.faiss_compact_shutdown_timeout)
+            with store.lock.write():
+                store.save_index()
+        except Exception as e:
+            logger.error(f"Error saving FAISS index {store.index_path}: {e}")
+
 
 class VectorStore:
     """Vector store adapter supporting Chroma and FAISS."""
@@ -34,6 +551,7 @@ class VectorStore:
         self.store_type = settings.vector_store.upper()
         self.db_path = Path(settings.chroma_db_path)
         self.db_path.mkdir(parents=True, exist_ok=True)
+        self._doc_info_key = (self.store_type, str(self.db_path.resolve()))
         
         if self.store_type == "CHROMA":
             if not HAS_CHROMA:
@@ -68,20 +586,7 @@ class VectorStore:
     def _init_faiss(self):
         """Initialize FAISS index."""
         try:
-            self.index_path = self.db_path / "faiss.index"
-            self.metadata_path = self.db_path / "metadata.json"
-            
-            # Load or create index
-            if self.index_path.exists():
-                self.index = faiss.read_index(str(self.index_path))
-                import json
-                with open(self.metadata_path, 'r') as f:
-                    self.metadata_store = json.load(f)
-            else:
-                # Create new index (dimension will be set on first add)
-                self.index = None
-                self.metadata_store = {}
-            
+            self._faiss = _get_faiss_store(self.db_path)
             logger.info("FAISS vector store initialized")
         except Exception as e:
             logger.error(f"Failed to initialize FAISS: {e}")
@@ -90,27 +595,71 @@ class VectorStore:
     def add_chunks(
         self,
         chunks: List[Dict[str, Any]],
-        embeddings: List[List[float]]
+        embeddings: Union[List[List[float]], "np.ndarray"]
     ):
-        """Add chunks with embeddings to vector store."""
+        """
+        Add chunks with embeddings to vector store.
+        
+        Embeddings may be a list of vectors or an (n, d) array; a contiguous
+        float32 array is used by FAISS without copying.
+        """
         if self.store_type == "CHROMA":
             self._add_chroma(chunks, embeddings)
         elif self.store_type == "FAISS":
             self._add_faiss(chunks, embeddings)
+        self._invalidate_doc_info()
     
-    def _add_chroma(self, chunks: List[Dict[str, Any]], embeddings: List[List[float]]):
+    def add_chunks_many(
+        self,
+        batches: Sequence[Tuple[List[Dict[str, Any]], Union[List[List[float]], "np.ndarray"]]]
+    ):
+        """
+        Add several (chunks, embeddings) batches with one store insert.
+        
+        The HNSW graph parallelizes insertion across the vectors of a
+        single add, so one large add beats many small ones.
+        """
+        batches = [(chunks, embeddings) for chunks, embeddings in batches if len(chunks)]
+        if not batches:
+            return
+        if len(batches) == 1:
+            self.add_chunks(*batches[0])
+            return
+        
+        chunks = [chunk for batch_chunks, _ in batches for chunk in batch_chunks]
+        if self.store_type == "FAISS":
+            embeddings = np.vstack([
+                np.asarray(batch_embeddings, dtype=np.float32) for _, batch_embeddings in batches
+            ])
+            # The stacked array is ours, so it can be normalized in place
+            self._add_faiss(chunks, embeddings, copy=False)
+        else:
+            embeddings = [
+                vector
+                for _, batch_embeddings in batches
+                for vector in (batch_embeddings if isinstance(batch_embeddings, list) else batch_embeddings.tolist())
+            ]
+            self._add_chroma(chunks, embeddings)
+        self._invalidate_doc_info()
+    
+    def _add_chroma(self, chunks: List[Dict[str, Any]], embeddings: Union[List[List[float]], "np.ndarray"]):
         """Add to Chroma."""
-        ids = [chunk['chunk_id'] for chunk in chunks]
-        texts = [chunk['text'] for chunk in chunks]
-        metadatas = [
-            {
-                'doc_id': chunk['doc_id'],
-                'page': chunk['page'],
-                'chunk_index': chunk['chunk_index'],
+        ids = []
+        texts = []
+        metadatas = []
+        for chunk in chunks:
+            chunk_id, text, doc_id, page, chunk_index = _chunk_fields(chunk)
+            ids.append(chunk_id)
+            texts.append(text)
+            metadatas.append({
+                'doc_id': doc_id,
+                'page': page,
+                'chunk_index': chunk_index,
                 'filename': chunk.get('filename', ''),
-            }
-            for chunk in chunks
-        ]
+            })
+        
+        if not isinstance(embeddings, list):
+            embeddings = embeddings.tolist()
         
         self.collection.add(
             ids=ids,
@@ -119,59 +668,102 @@ class VectorStore:
             metadatas=metadatas
         )
     
-    def _add_faiss(self, chunks: List[Dict[str, Any]], embeddings: List[List[float]]):
-        """Add to FAISS."""
-        import json
-        import numpy as np
-        
-        embeddings_array = np.array(embeddings, dtype='float32')
-        dimension = embeddings_array.shape[1]
-        
-        # Initialize index if needed
-        if self.index is None:
-            self.index = faiss.IndexFlatL2(dimension)
-        
-        # Add embeddings
-        self.index.add(embeddings_array)
-        
-        # Store metadata
-        start_id = len(self.metadata_store)
-        for i, chunk in enumerate(chunks):
-            chunk_id = chunk['chunk_id']
-            self.metadata_store[str(start_id + i)] = {
-                'chunk_id': chunk_id,
-                'doc_id': chunk['doc_id'],
-                'page': chunk['page'],
-                'chunk_index': chunk['chunk_index'],
-                'text': chunk['text'],
-                'filename': chunk.get('filename', ''),
-            }
+    def _add_faiss(
+        self,
+        chunks: List[Dict[str, Any]],
+        embeddings: Union[List[List[float]], "np.ndarray"],
+        copy: bool = True
+    ):
+        """
+        Add to FAISS.
         
-        # Save index and metadata
-        faiss.write_index(self.index, str(self.index_path))
-        with open(self.metadata_path, 'w') as f:
-            json.dump(self.metadata_store, f)
+        Vectors are converted to float32, normalized in place by
+        faiss.normalize_L2 and added in tiles of settings.faiss_add_tile_rows,
+        so list or float64 input never needs a full-size float32 copy; pass
+        copy=False when the array may be modified.
+        """
+        tile_rows = max(1, settings.faiss_add_tile_rows)
+        store = self._faiss
+        with store.lock.write():
+            # FAISS ids are metadata rows, which deletes never reuse
+            start_id = len(store.meta)
+            
+            for start in range(0, len(embeddings), tile_rows):
+                tile = embeddings[start:start + tile_rows]
+                tile_array = np.ascontiguousarray(tile, dtype=np.float32)
+                if copy and tile_array is tile:
+                    # A view of the caller's array; don't modify it
+                    tile_array = tile_array.copy()
+                faiss.normalize_L2(tile_array)
+                
+                # Initialize index if needed
+                if store.index is None:
+                    store.index = _new_faiss_index(tile_array.shape[1])
+                
+                first_id = start_id + start
+                store.index.add_with_ids(
+                    tile_array,
+                    np.arange(first_id, first_id + len(tile_array), dtype=np.int64)
+                )
+            
+            # Store metadata
+            meta = store.meta
+            for chunk in chunks:
+                chunk_id, text, doc_id, page, chunk_index = _chunk_fields(chunk)
+                meta.append(chunk_id, doc_id, chunk.get('filename', ''), page or 0, chunk_index or 0, text)
+            
+            store.append_metadata(meta.record(row) for row in range(start_id, len(meta)))
+            store.note_add()
+    
+    def flush(self):
+        """Persist pending FAISS index changes (Chroma persists on its own)."""
+        if self.store_type == "FAISS":
+            with self._faiss.lock.write():
+                self._faiss.save_index()
     
     def search(
         self,
-        query_embedding: List[float],
+        query_embedding: Union[Sequence[float], "np.ndarray"],
         top_k: int = 5,
         doc_ids: Optional[List[str]] = None,
         filter_dict: Optional[Dict[str, Any]] = None
     ) -> List[Dict[str, Any]]:
         """Search for similar chunks."""
         if self.store_type == "CHROMA":
-            return self._search_chroma(query_embedding, top_k, doc_ids, filter_dict)
+            if not isinstance(query_embedding, list):
+                query_embedding = query_embedding.tolist()
+            return self._search_chroma([query_embedding], top_k, doc_ids, filter_dict)[0]
+        elif self.store_type == "FAISS":
+            return self._search_faiss(query_embedding, top_k, doc_ids, filter_dict)[0]
+    
+    def search_batch(
+        self,
+        query_embeddings: Union[List[List[float]], "np.ndarray"],
+        top_k: int = 5,
+        doc_ids: Optional[List[str]] = None,
+        filter_dict: Optional[Dict[str, Any]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Search for several queries at once; returns one result list per
+        query. FAISS scores the stacked (nq, d) queries in one index call,
+        with the same document filter and exact fallback as search().
+        """
+        if not len(query_embeddings):
+            return []
+        if self.store_type == "CHROMA":
+            if not isinstance(query_embeddings, list):
+                query_embeddings = query_embeddings.tolist()
+            return self._search_chroma(query_embeddings, top_k, doc_ids, filter_dict)
         elif self.store_type == "FAISS":
-            return self._search_faiss(query_embedding, top_k, doc_ids, filter_dict)
+            return self._search_faiss(query_embeddings, top_k, doc_ids, filter_dict)
     
     def _search_chroma(
         self,
-        query_embedding: List[float],
+        query_embeddings: List[List[float]],
         top_k: int,
         doc_ids: Optional[List[str]],
         filter_dict: Optional[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
+    ) -> List[List[Dict[str, Any]]]:
         """Search in Chroma."""
         where = {}
         if doc_ids:
@@ -180,159 +772,259 @@ class VectorStore:
             where.update(filter_dict)
         
         results = self.collection.query(
-            query_embeddings=[query_embedding],
+            query_embeddings=query_embeddings,
             n_results=top_k,
             where=where if where else None
         )
         
         # Format results
-        formatted_results = []
-        if results['ids'] and len(results['ids'][0]) > 0:
-            for i in range(len(results['ids'][0])):
-                formatted_results.append({
-                    'chunk_id': results['ids'][0][i],
-                    'doc_id': results['metadatas'][0][i].get('doc_id', ''),
-                    'filename': results['metadatas'][0][i].get('filename', ''),
-                    'page': results['metadatas'][0][i].get('page', 0),
-                    'chunk_index': results['metadatas'][0][i].get('chunk_index', 0),
-                    'text': results['documents'][0][i],
-                    'score': 1.0 - results['distances'][0][i] if 'distances' in results else 0.0,
-                    'distance': results['distances'][0][i] if 'distances' in results else 0.0
-                })
+        all_results = []
+        for q in range(len(query_embeddings)):
+            ids = results['ids'][q] if results['ids'] else []
+            if 'distances' in results:
+                distances = results['distances'][q]
+                scores = [1.0 - distance for distance in distances]
+            else:
+                distances = scores = [0.0] * len(ids)
+            all_results.append([
+                {
+                    'chunk_id': chunk_id,
+                    'doc_id': metadata.get('doc_id', ''),
+                    'filename': metadata.get('filename', ''),
+                    'page': metadata.get('page', 0),
+                    'chunk_index': metadata.get('chunk_index', 0),
+                    'text': text,
+                    'score': score,
+                    'distance': distance
+                }
+                for chunk_id, metadata, text, score, distance in zip(
+                    ids, results['metadatas'][q], results['documents'][q], scores, distances
+                )
+            ])
         
-        return formatted_results
+        return all_results
     
     def _search_faiss(
         self,
-        query_embedding: List[float],
+        query_embeddings: Union[Sequence[float], List[List[float]], "np.ndarray"],
         top_k: int,
         doc_ids: Optional[List[str]],
         filter_dict: Optional[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
-        """Search in FAISS."""
-        import numpy as np
-        
-        query_array = np.array([query_embedding], dtype='float32')
-        distances, indices = self.index.search(query_array, top_k * 2)  # Get more to filter
+    ) -> List[List[Dict[str, Any]]]:
+        """Search in FAISS; a single query is treated as a batch of one."""
+        store = self._faiss
+        # A copy, since normalize_L2 works in place
+        query_array = np.array(query_embeddings, dtype=np.float32, ndmin=2)
+        faiss.normalize_L2(query_array)
+        empty = [[] for _ in range(len(query_array))]
         
-        results = []
-        for dist, idx in zip(distances[0], indices[0]):
-            if idx < 0 or str(idx) not in self.metadata_store:
-                continue
+        with store.lock.read():
+            if store.index is None:
+                return empty
+            meta = store.meta
             
-            metadata = self.metadata_store[str(idx)]
-            
-            # Filter by doc_ids if provided
-            if doc_ids and metadata['doc_id'] not in doc_ids:
-                continue
-            
-            # Convert distance to similarity score (L2 distance -> similarity)
-            score = 1.0 / (1.0 + dist)
-            
-            results.append({
-                'chunk_id': metadata['chunk_id'],
-                'doc_id': metadata['doc_id'],
-                'filename': metadata.get('filename', ''),
-                'page': metadata.get('page', 0),
-                'chunk_index': metadata.get('chunk_index', 0),
-                'text': metadata.get('text', ''),
-                'score': score,
-                'distance': float(dist)
-            })
+            if doc_ids:
+                allowed = np.array(
+                    [row for doc_id in doc_ids for row in meta.rows_by_doc.get(doc_id, ())],
+                    dtype=np.int64
+                )
+                if not len(allowed):
+                    return empty
+                k = min(top_k, len(allowed))
+                if len(allowed) <= settings.faiss_filter_exact_max_rows:
+                    # A graph walk rarely reaches a small set of allowed
+                    # rows, so score them exactly instead
+                    similarities, indices = _exact_search(store.index, query_array, allowed, k)
+                else:
+                    # Restrict the graph search to the documents' rows,
+                    # widening it in proportion to how selective the
+                    # filter is so it still reaches enough of them
+                    ef_search = settings.faiss_hnsw_ef_search * store.index.ntotal // len(allowed)
+                    params = faiss.SearchParametersHNSW(
+                        efSearch=min(max(ef_search, k * 2), store.index.ntotal),
+                        sel=faiss.IDSelectorBatch(allowed)
+                    )
+                    similarities, indices = store.index.search(query_array, k, params=params)
+                    if (indices[:, k - 1] < 0).any():
+                        # The walk still ran out before reaching k allowed
+                        # rows (e.g. a tightly clustered document far from
+                        # the query); fall back to exact scoring
+                        similarities, indices = _exact_search(store.index, query_array, allowed, k)
+            else:
+                # Get more to skip deleted rows; search breadth must be at
+                # least the result count
+                k = top_k * 2
+                params = faiss.SearchParametersHNSW(efSearch=max(settings.faiss_hnsw_ef_search, k * 2))
+                similarities, indices = store.index.search(query_array, k, params=params)
             
-            if len(results) >= top_k:
-                break
+            selected = _select_hits(indices, meta.alive, top_k)
+            all_results = []
+            for query_hits, query_similarities, query_indices in zip(
+                selected.tolist(), similarities.tolist(), indices.tolist()
+            ):
+                # Select the live hits first, then gather each metadata
+                # column in turn rather than hopping across all columns
+                # per hit
+                doc_id_col = meta.doc_ids
+                hits = [j for j in query_hits if j >= 0]
+                rows = [query_indices[j] for j in hits]
+                scores = [query_similarities[j] for j in hits]
+                doc_id_values = [doc_id_col[row] for row in rows]
+                chunk_ids = [meta.chunk_ids[row] for row in rows]
+                filename_table = meta.filename_table
+                filenames = [filename_table[meta.filename_ids[row]] for row in rows]
+                pages = [meta.pages[row] for row in rows]
+                chunk_indexes = [meta.chunk_indexes[row] for row in rows]
+                texts = [meta.texts[row] for row in rows]
+                
+                # Cosine similarity; distance as Chroma reports it for cosine space
+                all_results.append([
+                    {
+                        'chunk_id': chunk_id,
+                        'doc_id': doc_id,
+                        'filename': filename,
+                        'page': page,
+                        'chunk_index': chunk_index,
+                        'text': text,
+                        'score': score,
+                        'distance': 1.0 - score
+                    }
+                    for chunk_id, doc_id, filename, page, chunk_index, text, score in zip(
+                        chunk_ids, doc_id_values, filenames, pages, chunk_indexes, texts, scores
+                    )
+                ])
         
-        return results
+        return all_results
     
     def get_all_document_ids(self) -> Dict[str, Dict[str, Any]]:
         """
         Get all unique document IDs and their metadata from the vector store.
         
+        The result is cached per store until the next add or delete and is
+        shared between callers, so it must not be modified.
+        
         Returns:
             Dictionary mapping doc_id to metadata (filename, chunk_count, max_page)
         """
+        key = self._doc_info_key
+        with _doc_info_lock:
+            cached = _doc_info_cache.get(key)
+            version = _doc_info_versions.get(key, 0)
+        if cached is not None:
+            return cached
+        
+        try:
+            if self.store_type == "CHROMA":
+                doc_info = self._chroma_document_info()
+            else:
+                doc_info = self._faiss_document_info()
+        except Exception as e:
+            logger.error(f"Error getting document IDs from {self.store_type}: {e}", exc_info=True)
+            return {}
+        
+        with _doc_info_lock:
+            if _doc_info_versions.get(key, 0) == version:
+                _doc_info_cache[key] = doc_info
+        return doc_info
+    
+    def _chroma_document_info(self) -> Dict[str, Dict[str, Any]]:
+        """Scan Chroma metadata for per-document info."""
         doc_info = {}
         
-        if self.store_type == "CHROMA":
-            # Get all documents from Chroma
-            try:
-                # Get all items (with a large limit)
-                results = self.collection.get(limit=100000)  # Large limit to get all
-                
-                # Chroma's get() returns: {'ids': [...], 'metadatas': [...], 'documents': [...]}
-                ids = results.get('ids', [])
-                metadatas = results.get('metadatas', [])
-                
-                if ids and len(ids) > 0:
-                    for i in range(len(ids)):
-                        metadata = metadatas[i] if i < len(metadatas) else {}
-                        if metadata and 'doc_id' in metadata:
-                            doc_id_val = metadata['doc_id']
-                            filename = metadata.get('filename', '')
-                            page = metadata.get('page', 0)
-                            
-                            if doc_id_val not in doc_info:
-                                doc_info[doc_id_val] = {
-                                    'filename': filename,
-                                    'chunk_count': 0,
-                                    'max_page': 0
-                                }
-                            
-                            doc_info[doc_id_val]['chunk_count'] += 1
-                            doc_info[doc_id_val]['max_page'] = max(
-                                doc_info[doc_id_val]['max_page'], 
-                                page if isinstance(page, int) else 0
-                            )
-            except Exception as e:
-                logger.error(f"Error getting document IDs from Chroma: {e}", exc_info=True)
-                
-        elif self.store_type == "FAISS":
-            # Get all documents from FAISS metadata
-            try:
-                for key, metadata in self.metadata_store.items():
-                    doc_id = metadata.get('doc_id')
-                    if not doc_id:
-                        continue
-                    
+        # Get all items (with a large limit); only metadata is needed, so
+        # skip fetching document text and embeddings
+        results = self.collection.get(limit=100000, include=['metadatas'])
+        
+        # Chroma's get() returns: {'ids': [...], 'metadatas': [...]}
+        ids = results.get('ids', [])
+        metadatas = results.get('metadatas', [])
+        
+        if ids and len(ids) > 0:
+            for i in range(len(ids)):
+                metadata = metadatas[i] if i < len(metadatas) else {}
+                if metadata and 'doc_id' in metadata:
+                    doc_id_val = metadata['doc_id']
                     filename = metadata.get('filename', '')
                     page = metadata.get('page', 0)
                     
-                    if doc_id not in doc_info:
-                        doc_info[doc_id] = {
+                    if doc_id_val not in doc_info:
+                        doc_info[doc_id_val] = {
                             'filename': filename,
                             'chunk_count': 0,
                             'max_page': 0
                         }
                     
-                    doc_info[doc_id]['chunk_count'] += 1
-                    doc_info[doc_id]['max_page'] = max(
-                        doc_info[doc_id]['max_page'],
+                    doc_info[doc_id_val]['chunk_count'] += 1
+                    doc_info[doc_id_val]['max_page'] = max(
+                        doc_info[doc_id_val]['max_page'], 
                         page if isinstance(page, int) else 0
                     )
-            except Exception as e:
-                logger.error(f"Error getting document IDs from FAISS: {e}")
         
         return doc_info
     
+    def _faiss_document_info(self) -> Dict[str, Dict[str, Any]]:
+        """Group FAISS metadata columns into per-document info."""
+        doc_info = {}
+        
+        meta = self._faiss.meta
+        with self._faiss.lock.read():
+            doc_arr = np.array(meta.doc_ids, dtype=object)
+            pages = np.array(meta.pages, dtype=np.int32)
+            filename_ids = np.array(meta.filename_ids, dtype=np.int32)
+            filename_table = list(meta.filename_table)
+        
+        # Group live rows by doc_id: a stable sort keeps each
+        # document's rows in insertion order, so its first row
+        # supplies the filename
+        live = np.flatnonzero(doc_arr.astype(bool))
+        if len(live):
+            live_docs = doc_arr[live].astype(str)
+            order = np.argsort(live_docs, kind='stable')
+            uniq, starts, counts = np.unique(
+                live_docs[order], return_index=True, return_counts=True
+            )
+            max_pages = np.maximum.reduceat(pages[live][order], starts)
+            first_filename_ids = filename_ids[live[order[starts]]]
+            
+            for doc_id, filename_id, count, max_page in zip(
+                uniq.tolist(), first_filename_ids.tolist(), counts.tolist(), max_pages.tolist()
+            ):
+                doc_info[doc_id] = {
+                    'filename': filename_table[filename_id],
+                    'chunk_count': count,
+                    'max_page': max_page
+                }
+        
+        return doc_info
+    
+    def _invalidate_doc_info(self, deleted_doc_id: Optional[str] = None):
+        """
+        Update the shared document info cache after a write: a deleted
+        document is dropped from it, anything else clears it.
+        """
+        key = self._doc_info_key
+        with _doc_info_lock:
+            _doc_info_versions[key] = _doc_info_versions.get(key, 0) + 1
+            cached = _doc_info_cache.pop(key, None)
+            if deleted_doc_id is not None and cached is not None:
+                cached = dict(cached)
+                cached.pop(deleted_doc_id, None)
+                _doc_info_cache[key] = cached
+    
     def delete_document(self, doc_id: str):
         """Delete all chunks for a document."""
         if self.store_type == "CHROMA":
             # Chroma doesn't have a direct delete by metadata, so we need to query first
-            results = self.collection.get(where={"doc_id": doc_id})
+            results = self.collection.get(where={"doc_id": doc_id}, include=[])
             if results['ids']:
                 self.collection.delete(ids=results['ids'])
         elif self.store_type == "FAISS":
-            # For FAISS, we mark as deleted in metadata
-            import json
-            to_remove = []
-            for key, metadata in self.metadata_store.items():
-                if metadata.get('doc_id') == doc_id:
-                    to_remove.append(key)
-            
-            for key in to_remove:
-                del self.metadata_store[key]
-            
-            with open(self.metadata_path, 'w') as f:
-                json.dump(self.metadata_store, f)
-
+            # For FAISS, we mark as deleted in metadata; vectors are
+            # dropped when the index is compacted
+            store = self._faiss
+            with store.lock.write():
+                to_remove = store.meta.clear_doc(doc_id)
+                if to_remove:
+                    store.append_metadata([{'deleted': to_remove}])
+                    store.compact_if_needed()
+        self._invalidate_doc_info(deleted_doc_id=doc_id)
@@ -0,0 +1,186 @@
+"""Tests for the FAISS vector store."""
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+from app.config import settings
+from app.services import vector_store
+from app.services.vector_store import VectorStore
+
+DIMENSION = 32
+
+
+@pytest.fixture
+def faiss_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "vector_store", "FAISS")
+    monkeypatch.setattr(settings, "chroma_db_path", str(tmp_path))
+    return VectorStore()
+
+
+def _chunks(doc_id, count):
+    return [
+        {
+            'chunk_id': f"{doc_id}-{i}",
+            'text': f"chunk {i}",
+            'doc_id': doc_id,
+            'page': i,
+            'chunk_index': i,
+            'filename': f"{doc_id}.pdf",
+        }
+        for i in range(count)
+    ]
+
+
+def test_doc_scoped_search_returns_all_small_doc_chunks(faiss_store):
+    rng = np.random.default_rng(0)
+    doc_chunks = 4
+    for doc in range(1000):
+        faiss_store.add_chunks(_chunks(f"doc{doc}", doc_chunks), rng.standard_normal((doc_chunks, DIMENSION)))
+    
+    for top_k in (2, 5):
+        for _ in range(50):
+            doc_id = f"doc{rng.integers(1000)}"
+            results = faiss_store.search(rng.standard_normal(DIMENSION), top_k=top_k, doc_ids=[doc_id])
+            assert len(results) == min(top_k, doc_chunks)
+            assert all(result['doc_id'] == doc_id for result in results)
+
+
+def test_doc_scoped_graph_search_reaches_clustered_doc(faiss_store, monkeypatch):
+    # Force the filtered graph search rather than exact scoring
+    monkeypatch.setattr(settings, "faiss_filter_exact_max_rows", 0)
+    rng = np.random.default_rng(1)
+    faiss_store.add_chunks(_chunks("background", 4000), rng.standard_normal((4000, DIMENSION)))
+    center = rng.standard_normal(DIMENSION)
+    faiss_store.add_chunks(_chunks("clustered", 100), center + 0.05 * rng.standard_normal((100, DIMENSION)))
+    
+    for _ in range(50):
+        # Off-topic queries, far from the clustered document
+        results = faiss_store.search(rng.standard_normal(DIMENSION) - center, top_k=5, doc_ids=["clustered"])
+        assert len(results) == 5
+        assert all(result['doc_id'] == "clustered" for result in results)
+
+
+def test_doc_scoped_search_matches_exact_ranking(faiss_store):
+    rng = np.random.default_rng(2)
+    vectors = rng.standard_normal((10, DIMENSION)).astype(np.float32)
+    faiss_store.add_chunks(_chunks("doc", 10), vectors)
+    faiss_store.add_chunks(_chunks("other", 10), rng.standard_normal((10, DIMENSION)))
+    
+    query = rng.standard_normal(DIMENSION).astype(np.float32)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = [f"doc-{i}" for i in np.argsort(-(normalized @ query))[:3]]
+    
+    results = faiss_store.search(query, top_k=3, doc_ids=["doc"])
+    assert [result['chunk_id'] for result in results] == expected
+
+
+def test_add_chunks_many_matches_separate_adds(faiss_store):
+    rng = np.random.default_rng(3)
+    first = rng.standard_normal((3, DIMENSION)).astype(np.float32)
+    second = rng.standard_normal((5, DIMENSION)).tolist()
+    first_before = first.copy()
+    
+    faiss_store.add_chunks_many([(_chunks("first", 3), first), (_chunks("second", 5), second)])
+    
+    # The caller's array is left as it was
+    np.testing.assert_array_equal(first, first_before)
+    doc_info = faiss_store.get_all_document_ids()
+    assert doc_info["first"]['chunk_count'] == 3
+    assert doc_info["second"]['chunk_count'] == 5
+    for i, vector in enumerate(second):
+        results = faiss_store.search(vector, top_k=1)
+        assert results[0]['chunk_id'] == f"second-{i}"
+
+
+def test_search_runs_while_another_search_holds_the_lock(faiss_store):
+    rng = np.random.default_rng(4)
+    vectors = rng.standard_normal((5, DIMENSION)).astype(np.float32)
+    faiss_store.add_chunks(_chunks("doc", 5), vectors)
+    
+    results = []
+    with faiss_store._faiss.lock.read():
+        # A second reader must not wait for the first
+        worker = threading.Thread(target=lambda: results.extend(faiss_store.search(vectors[0], top_k=1)))
+        worker.start()
+        worker.join(timeout=5)
+        assert not worker.is_alive()
+    assert results[0]['chunk_id'] == "doc-0"
+
+
+@pytest.fixture
+def paused_rebuild(monkeypatch):
+    """Hold background compactions until the test sets the returned resume event."""
+    monkeypatch.setattr(settings, "faiss_compact_deleted_ratio", 0.2)
+    rebuild_started, resume = threading.Event(), threading.Event()
+    new_faiss_index = vector_store._new_faiss_index
+    
+    def new_index(d):
+        if threading.current_thread().name == "faiss-compaction":
+            rebuild_started.set()
+            resume.wait(timeout=10)
+        return new_faiss_index(d)
+    
+    monkeypatch.setattr(vector_store, "_new_faiss_index", new_index)
+    return rebuild_started, resume
+
+
+def test_compaction_keeps_chunks_added_during_rebuild(faiss_store, paused_rebuild):
+    rebuild_started, resume = paused_rebuild
+    rng = np.random.default_rng(5)
+    faiss_store.add_chunks(_chunks("gone", 10), rng.standard_normal((10, DIMENSION)))
+    kept = rng.standard_normal((10, DIMENSION)).astype(np.float32)
+    faiss_store.add_chunks(_chunks("kept", 10), kept)
+    late = rng.standard_normal((3, DIMENSION)).astype(np.float32)
+    
+    faiss_store.delete_document("gone")
+    assert rebuild_started.wait(timeout=10)
+    faiss_store.add_chunks(_chunks("late", 3), late)
+    resume.set()
+    store = faiss_store._faiss
+    store.wait_for_compaction(timeout=10)
+    
+    assert store.index.ntotal == 13
+    for vectors, doc_id in ((kept, "kept"), (late, "late")):
+        for i, vector in enumerate(vectors):
+            assert faiss_store.search(vector, top_k=1)[0]['chunk_id'] == f"{doc_id}-{i}"
+
+
+def test_compaction_drops_chunks_deleted_during_rebuild(faiss_store, paused_rebuild):
+    rebuild_started, resume = paused_rebuild
+    rng = np.random.default_rng(6)
+    for doc_id in ("gone", "also-gone", "kept"):
+        faiss_store.add_chunks(_chunks(doc_id, 10), rng.standard_normal((10, DIMENSION)))
+    
+    faiss_store.delete_document("gone")
+    assert rebuild_started.wait(timeout=10)
+    faiss_store.delete_document("also-gone")
+    resume.set()
+    store = faiss_store._faiss
+    store.wait_for_compaction(timeout=10)
+    
+    assert store.index.ntotal == 10
+    assert set(faiss_store.get_all_document_ids()) == {"kept"}
+    
+    # The snapshot matches: a reload sees only the kept document
+    vector_store._faiss_stores.clear()
+    assert set(VectorStore().get_all_document_ids()) == {"kept"}
+    assert VectorStore()._faiss.index.ntotal == 10
+
+
+def test_search_batch_matches_single_searches(faiss_store):
+    rng = np.random.default_rng(7)
+    faiss_store.add_chunks(_chunks("doc", 20), rng.standard_normal((20, DIMENSION)))
+    faiss_store.add_chunks(_chunks("other", 20), rng.standard_normal((20, DIMENSION)))
+    queries = rng.standard_normal((4, DIMENSION)).astype(np.float32)
+    
+    assert faiss_store.search_batch(queries[:0]) == []
+    for doc_ids in (None, ["doc"]):
+        batch = faiss_store.search_batch(queries, top_k=3, doc_ids=doc_ids)
+        assert len(batch) == len(queries)
+        for query, results in zip(queries, batch):
+            single = faiss_store.search(query, top_k=3, doc_ids=doc_ids)
+            assert [result['chunk_id'] for result in results] == [result['chunk_id'] for result in single]
+            assert [result['score'] for result in results] == pytest.approx([result['score'] for result in single])